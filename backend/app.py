@@ -27,11 +27,10 @@ def serve_static(filename):
 if __name__ == '__main__':
     init_db()
 
-    from backend.services.embeddings import EmbeddingsService
+    from backend.services import start_warmup, start_ingestion
 
-    embeddings = EmbeddingsService()
-    if embeddings.index.ntotal == 0:
-        embeddings.rebuild_index()
+    start_warmup()
+    start_ingestion()
 
     print(f"Starting Flask server on {config.FLASK_HOST}:{config.FLASK_PORT}")
     app.run(
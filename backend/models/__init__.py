@@ -3,5 +3,6 @@ from .document import Document
 from .user import User
 from .stats import Stats
 from .favorite import Favorite
+from .ingestion_job import IngestionJob
 
-__all__ = ['db', 'init_db', 'Document', 'User', 'Stats']
+__all__ = ['db', 'init_db', 'Document', 'User', 'Stats', 'IngestionJob']
@@ -4,15 +4,40 @@ import config
 db = SqliteDatabase(config.DATABASE_PATH)
 
 
+def _add_missing_columns(model):
+    # Databases created by earlier versions get new nullable columns added in place. Runs before
+    # create_tables, whose indexes on a missing column would otherwise be built on a string literal.
+    import copy
+    from playhouse.migrate import SqliteMigrator, migrate
+
+    table = model._meta.table_name
+    if not db.table_exists(table):
+        return
+
+    existing = {column.name for column in db.get_columns(table)}
+    migrator = SqliteMigrator(db)
+    operations = []
+    for field in model._meta.sorted_fields:
+        if field.column_name not in existing:
+            # create_tables adds the field's index afterwards
+            column = copy.copy(field)
+            column.index = column.unique = False
+            operations.append(migrator.add_column(table, field.column_name, column))
+    if operations:
+        migrate(*operations)
+
+
 def init_db():
     from .document import Document
     from .user import User
     from .stats import Stats
     from .favorite import Favorite
+    from .ingestion_job import IngestionJob
     import os
 
     db.connect()
-    db.create_tables([Document, User, Stats, Favorite], safe=True)
+    _add_missing_columns(Document)
+    db.create_tables([Document, User, Stats, Favorite, IngestionJob], safe=True)
 
     docs_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'docs')
     if not os.path.exists(docs_dir):
@@ -25,18 +50,37 @@ def init_db():
         if filename not in existing_files:
             db_documents[filename].delete_instance()
 
-    for filename in existing_files:
-        if filename not in db_documents:
-            from backend.services.file_parser import FileParser
+    from backend.services.file_parser import FileParser
+    from backend.services.ingestion import enqueue_document
+
+    known_hashes = {}
+    for doc in Document.select():
+        if not doc.content_hash and os.path.exists(doc.file_path):
+            doc.content_hash = FileParser.file_hash(doc.file_path)
+            doc.save()
+        if doc.content_hash:
+            known_hashes[doc.content_hash] = doc.filename
+
+    pending = IngestionJob.select().where(IngestionJob.status.in_(IngestionJob.PENDING))
+    queued_files = {job.filename for job in pending}
+    known_hashes.update((job.content_hash, job.filename) for job in pending if job.content_hash)
+
+    # New files are only hashed and queued here; the Flask process parses and indexes them in the
+    # background. Byte-identical copies under another name are skipped before parsing.
+    queued = 0
+    for filename in sorted(existing_files):
+        if filename not in db_documents and filename not in queued_files:
             file_path = os.path.join(docs_dir, filename)
-            result = FileParser.parse_pdf(file_path)
+            content_hash = FileParser.file_hash(file_path)
+            if content_hash in known_hashes:
+                print(f"Skipping {filename}: identical to {known_hashes[content_hash]}")
+                continue
+
+            enqueue_document(filename, file_path, content_hash, source='scan')
+            known_hashes[content_hash] = filename
+            queued += 1
 
-            if result['success']:
-                Document.create(
-                    filename=filename,
-                    content=result['content'],
-                    file_path=file_path,
-                    pages_count=result['pages_count']
-                )
+    if queued:
+        print(f"Queued {queued} new documents for ingestion")
 
-    db.close()
\ No newline at end of file
+    db.close()
@@ -1,5 +1,6 @@
 from peewee import Model, CharField, TextField, DateTimeField
 from datetime import datetime
+import json
 from .base import db
 
 class Document(Model):
@@ -8,6 +9,10 @@ class Document(Model):
     upload_date = DateTimeField(default=datetime.now)
     file_path = CharField(max_length=512)
     pages_count = CharField(null=True)
+    content_hash = CharField(max_length=64, null=True, index=True)
+    # Backend the text was extracted with and, when chosen automatically, the per-backend sample timings (JSON)
+    parse_method = CharField(max_length=16, null=True)
+    parse_stats = TextField(null=True)
     
     class Meta:
         database = db
@@ -19,5 +24,8 @@ class Document(Model):
             'filename': self.filename,
             'upload_date': self.upload_date.strftime('%Y-%m-%d %H:%M:%S'),
             'pages_count': self.pages_count,
+            'content_hash': self.content_hash,
+            'parse_method': self.parse_method,
+            'parse_stats': json.loads(self.parse_stats) if self.parse_stats else None,
             'content_length': len(self.content) if self.content else 0
         }
@@ -0,0 +1,52 @@
+from peewee import Model, CharField, TextField, DateTimeField, IntegerField, FloatField
+from datetime import datetime
+from .base import db
+
+
+class IngestionJob(Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+    PENDING = (QUEUED, RUNNING)
+
+    filename = CharField(max_length=255, index=True)
+    file_path = CharField(max_length=512)
+    content_hash = CharField(max_length=64, null=True)
+    # 'upload' files are removed when they cannot be parsed; 'scan' files were found in docs/
+    source = CharField(max_length=16, default='upload')
+    status = CharField(max_length=16, default=QUEUED, index=True)
+    stage = CharField(max_length=16, null=True)
+    progress = FloatField(default=0)
+    pages_count = IntegerField(null=True)
+    chunks_count = IntegerField(null=True)
+    error = TextField(null=True)
+    attempts = IntegerField(default=0)
+    created_at = DateTimeField(default=datetime.now)
+    started_at = DateTimeField(null=True)
+    finished_at = DateTimeField(null=True)
+
+    class Meta:
+        database = db
+        table_name = 'ingestion_jobs'
+
+    def to_dict(self):
+        def timestamp(value):
+            return value.strftime('%Y-%m-%d %H:%M:%S') if value else None
+
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'source': self.source,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': round(self.progress, 3),
+            'pages_count': self.pages_count,
+            'chunks_count': self.chunks_count,
+            'error': self.error,
+            'attempts': self.attempts,
+            'created_at': timestamp(self.created_at),
+            'started_at': timestamp(self.started_at),
+            'finished_at': timestamp(self.finished_at)
+        }
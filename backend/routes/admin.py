@@ -1,18 +1,47 @@
 from flask import Blueprint, request, jsonify
-from backend.services import DatabaseService, FileParser, EmbeddingsService
+from backend.services import DatabaseService, FileParser, get_embeddings_service, enqueue_document, pending_job, get_job, \
+    get_parse_cache
 import os
 import config
 
 admin = Blueprint('admin', __name__)
 
-_embeddings_service = None
 
+def _name_taken(filename: str):
+    if DatabaseService.get_document(filename):
+        return jsonify({'success': False, 'error': 'Document with this name already exists'}), 400
 
-def get_embeddings_service():
-    global _embeddings_service
-    if _embeddings_service is None:
-        _embeddings_service = EmbeddingsService()
-    return _embeddings_service
+    if pending_job(filename=filename):
+        return jsonify({'success': False, 'error': 'Document with this name is already being processed'}), 409
+
+    return None
+
+
+def _enqueue_file(filename: str, staged_path: str, owned: bool = True):
+    # An owned file is dropped when it duplicates another document, otherwise renamed to DOCS_DIR/filename
+    content_hash = FileParser.file_hash(staged_path)
+    duplicate = DatabaseService.get_document_by_hash(content_hash) or pending_job(content_hash=content_hash)
+    if duplicate:
+        if owned:
+            os.remove(staged_path)
+        return jsonify({
+            'success': False,
+            'error': f"Identical to existing document '{duplicate.filename}'",
+            'duplicate_of': duplicate.filename
+        }), 409
+
+    file_path = os.path.join(config.DOCS_DIR, filename)
+    if staged_path != file_path:
+        os.replace(staged_path, file_path)
+
+    # Parsing and embedding happen on the ingestion workers; progress is at /admin/jobs/<id>
+    job = enqueue_document(filename, file_path, content_hash)
+
+    return jsonify({
+        'success': True,
+        'message': f"Document '{filename}' queued for processing",
+        'job': job.to_dict()
+    }), 202
 
 
 @admin.route('/upload', methods=['POST'])
@@ -32,47 +61,72 @@ def upload_document():
         import urllib.parse
         filename = urllib.parse.unquote(file.filename)
 
-        existing_doc = DatabaseService.get_document(filename)
-        if existing_doc:
-            return jsonify({'success': False, 'error': 'Document with this name already exists'}), 400
+        taken = _name_taken(filename)
+        if taken:
+            return taken
 
         file_path = os.path.join(config.DOCS_DIR, filename)
         file.save(file_path)
 
-        parse_result = FileParser.parse_pdf(file_path)
+        return _enqueue_file(filename, file_path)
 
-        if not parse_result['success']:
-            os.remove(file_path)
-            return jsonify({'success': False, 'error': f"Failed to parse PDF: {parse_result['error']}"}), 500
-
-        doc = DatabaseService.add_document(
-            filename=filename,
-            content=parse_result['content'],
-            file_path=file_path,
-            pages_count=parse_result['pages_count']
-        )
-
-        try:
-            get_embeddings_service().add_document(
-                text=parse_result['content'],
-                filename=filename
-            )
-        except Exception as e:
-            return jsonify({'success': False, 'error': f"Embeddings error: {str(e)}"}), 500
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"Upload error: {error_details}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-        return jsonify({
-            'success': True,
-            'message': f"Document '{filename}' uploaded successfully",
-            'document': doc.to_dict()
-        })
+
+@admin.route('/ingest', methods=['POST'])
+def ingest_document():
+    # For callers sharing DOCS_DIR (the bot): the file is already on disk, only its name is sent.
+    # 'staged' is the name it was written under, so a half-written file never looks like a document.
+    try:
+        data = request.get_json(silent=True) or {}
+        filename = data.get('filename') or ''
+        staged = data.get('staged') or filename
+
+        if not filename.lower().endswith('.pdf'):
+            return jsonify({'success': False, 'error': 'Only PDF files are supported'}), 400
+
+        # Only plain names inside DOCS_DIR are accepted
+        if any(os.path.basename(name) != name or name.startswith('.') for name in (filename, staged)):
+            return jsonify({'success': False, 'error': 'Invalid file name'}), 400
+
+        # A staged file is removed or renamed below, so it must be the caller's own .part download
+        owned = staged != filename
+        if owned and (not staged.endswith('.part') or DatabaseService.get_document(staged)
+                      or pending_job(filename=staged)):
+            return jsonify({'success': False, 'error': 'Invalid staged file name'}), 400
+
+        staged_path = os.path.join(config.DOCS_DIR, staged)
+        if not os.path.isfile(staged_path):
+            return jsonify({'success': False, 'error': 'File not found'}), 404
+
+        taken = _name_taken(filename)
+        if taken:
+            if owned:
+                os.remove(staged_path)
+            return taken
+
+        return _enqueue_file(filename, staged_path, owned)
 
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
-        print(f"Upload error: {error_details}")
+        print(f"Ingest error: {error_details}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@admin.route('/jobs/<int:job_id>', methods=['GET'])
+def job_status(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+
 @admin.route('/delete/<filename>', methods=['DELETE'])
 def delete_document(filename):
     try:
@@ -88,7 +142,9 @@ def delete_document(filename):
         if os.path.exists(file_path):
             os.remove(file_path)
 
-        get_embeddings_service().rebuild_index()
+        embeddings_service = get_embeddings_service()
+        embeddings_service.remove_document(filename)
+        embeddings_service.save_index()
 
         return jsonify({
             'success': True,
@@ -105,8 +161,9 @@ def delete_document(filename):
 @admin.route('/rebuild', methods=['POST'])
 def rebuild_embeddings():
     try:
-        get_embeddings_service().rebuild_index()
-        stats = get_embeddings_service().get_stats()
+        embeddings_service = get_embeddings_service()
+        embeddings_service.rebuild_index()
+        stats = embeddings_service.get_stats()
 
         return jsonify({
             'success': True,
@@ -118,4 +175,25 @@ def rebuild_embeddings():
         return jsonify({
             'success': False,
             'error': str(e)
-        }), 500
\ No newline at end of file
+        }), 500
+
+@admin.route('/parse-cache', methods=['DELETE'])
+def clear_parse_cache():
+    try:
+        cache = get_parse_cache()
+        if cache is None:
+            return jsonify({'success': False, 'error': 'Parse cache is disabled'}), 400
+
+        # ?hash=<sha256> drops a single file, otherwise the whole cache is cleared
+        removed = cache.invalidate(request.args.get('hash'))
+        return jsonify({
+            'success': True,
+            'message': f'Removed {removed} parse cache entries',
+            'stats': cache.get_stats()
+        })
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
-from backend.services import GigaChatClient, DatabaseService, EmbeddingsService
+from backend.services import GigaChatClient, DatabaseService, get_embeddings_service, get_readiness, get_ingestion_queue, \
+    get_parse_cache
 from backend.models import User, Stats, Favorite
 from datetime import datetime
 import config
@@ -7,7 +8,6 @@ import config
 api = Blueprint('api', __name__)
 
 giga_client = GigaChatClient()
-embeddings_service = EmbeddingsService()
 
 
 @api.route('/ask', methods=['POST'])
@@ -24,6 +24,16 @@ def ask_question():
         first_name = data.get('first_name')
         last_name = data.get('last_name')
         system_prompt = data.get('system_prompt')
+        documents = data.get('documents')
+
+        if documents is not None:
+            if isinstance(documents, str):
+                documents = [documents]
+            if not isinstance(documents, list) or not all(isinstance(d, str) for d in documents):
+                return jsonify({'success': False, 'error': 'documents must be a list of document names'}), 400
+            documents = get_embeddings_service().resolve_documents(documents)
+            if not documents:
+                return jsonify({'success': False, 'error': 'No indexed documents match the filter'}), 400
 
         if telegram_id:
             user = DatabaseService.get_or_create_user(
@@ -37,14 +47,18 @@ def ask_question():
         if system_prompt:
             result = giga_client.ask(question, context=None, system_prompt=system_prompt)
         else:
-            result = giga_client.ask_with_rag(question, embeddings_service)
+            result = giga_client.ask_with_rag(question, get_embeddings_service(), documents)
 
         if result['success']:
             return jsonify({
                 'success': True,
                 'answer': result['response'],
                 'context_used': result.get('context_used', False),
-                'tokens_used': result.get('tokens_used', 0)
+                'tokens_used': result.get('tokens_used', 0),
+                'cached': result.get('cached', False),
+                'context_tokens': result.get('context_tokens', 0),
+                'context_tokens_saved': result.get('context_tokens_saved', 0),
+                'documents': documents
             })
         else:
             return jsonify({'success': False, 'error': result['error']})
@@ -59,12 +73,15 @@ def ask_question():
 def get_stats():
     try:
         stats = DatabaseService.get_statistics()
-        embeddings_stats = embeddings_service.get_stats() if embeddings_service else {}
+        embeddings_stats = get_embeddings_service().get_stats()
 
         return jsonify({
             'success': True,
             'database': stats,
-            'embeddings': embeddings_stats
+            'embeddings': embeddings_stats,
+            'answer_cache': giga_client.answer_cache.get_stats(),
+            'ingestion': get_ingestion_queue().get_stats() if get_ingestion_queue() else None,
+            'parse_cache': get_parse_cache().get_stats() if get_parse_cache() else None
         })
     except Exception as e:
         return jsonify({
@@ -90,8 +107,12 @@ def list_documents():
 
 @api.route('/health', methods=['GET'])
 def health_check():
+    readiness = get_readiness()
     return jsonify({
         'status': 'healthy',
+        'ready': readiness['status'],
+        'warmup_seconds': readiness['seconds'],
+        'error': readiness['error'],
         'timestamp': datetime.now().isoformat(),
         'version': '1.0.0'
     })
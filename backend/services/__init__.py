@@ -1,6 +1,10 @@
 from .giga_api import GigaChatClient
 from .file_parser import FileParser
 from .db_service import DatabaseService
-from .embeddings import EmbeddingsService
+from .embeddings import EmbeddingsService, get_embeddings_service, start_warmup, get_readiness
+from .parse_cache import get_parse_cache
+from .ingestion import enqueue_document, pending_job, get_job, start_ingestion, get_ingestion_queue
 
-__all__ = ['GigaChatClient', 'FileParser', 'DatabaseService', 'EmbeddingsService']
+__all__ = ['GigaChatClient', 'FileParser', 'DatabaseService', 'EmbeddingsService', 'get_embeddings_service',
+           'start_warmup', 'get_readiness', 'enqueue_document', 'pending_job', 'get_job', 'start_ingestion',
+           'get_ingestion_queue', 'get_parse_cache']
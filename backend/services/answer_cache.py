@@ -0,0 +1,141 @@
+import re
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Optional, Tuple
+from .lexical_index import TOKEN_RE, tokenize
+
+NUMBER_RE = re.compile(r'\d+(?:[.,]\d+)?')
+# Negations and comparisons flip the meaning of a question while changing a single word (tokenize() even drops
+# some of them as stop words), so a cached question must use exactly the same ones
+QUALIFIERS = frozenset((
+    'не', 'нет', 'ни', 'без', 'нельзя', 'выше', 'ниже', 'более', 'менее', 'больше', 'меньше', 'свыше', 'до', 'от',
+    'после', 'перед', 'раньше', 'позже', 'максимальный', 'максимальная', 'минимальный', 'минимальная'
+))
+
+
+class SemanticAnswerCache:
+    def __init__(self, capacity: int, threshold: float, min_overlap: float):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.min_overlap = min_overlap
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.version = None
+        self._entries = OrderedDict()
+        self._next_key = 0
+        self._matrix = None
+        self._keys = []
+        self._scopes = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype='float32').reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _reset_for(self, version: int) -> bool:
+        # Entries belong to one index version. A newer version empties the cache; a request still working on an
+        # older one must not, so it is just told that the cache does not apply to it
+        if self.version is None or version > self.version:
+            self._entries.clear()
+            self._matrix = None
+            self.version = version
+        return version == self.version
+
+    @staticmethod
+    def signature(question: str) -> Tuple[FrozenSet[str], Tuple[str, ...], FrozenSet[str]]:
+        words = TOKEN_RE.findall(question.lower().replace('ё', 'е'))
+        numbers = tuple(number.replace(',', '.') for number in NUMBER_RE.findall(question))
+        return frozenset(tokenize(question)), numbers, frozenset(word for word in words if word in QUALIFIERS)
+
+    def _same_question(self, a: Tuple, b: Tuple) -> bool:
+        # Embeddings of the English MiniLM barely move for "выше 1,8 м" vs "ниже 1,8 м" or a dropped "не",
+        # so a vector match also needs the same numbers and qualifiers and mostly the same stemmed terms
+        terms_a, numbers_a, qualifiers_a = a
+        terms_b, numbers_b, qualifiers_b = b
+        if numbers_a != numbers_b or qualifiers_a != qualifiers_b:
+            return False
+        union = terms_a | terms_b
+        return not union or len(terms_a & terms_b) / len(union) >= self.min_overlap
+
+    # Answers restricted to some documents are only reused for questions with the same restriction
+    @staticmethod
+    def scope_of(documents) -> Optional[Tuple[str, ...]]:
+        return tuple(sorted(documents)) if documents is not None else None
+
+    def get(self, vector: np.ndarray, question: str, version: int,
+            scope: Optional[Tuple[str, ...]] = None) -> Optional[Dict]:
+        with self._lock:
+            if not self._reset_for(version) or not self._entries:
+                self.misses += 1
+                return None
+
+            if self._matrix is None:
+                self._keys = list(self._entries)
+                self._scopes = [self._entries[key]['scope'] for key in self._keys]
+                self._matrix = np.vstack([self._entries[key]['vector'] for key in self._keys])
+
+            similarities = self._matrix @ self._unit(vector)
+            similarities[[s != scope for s in self._scopes]] = -1.0
+
+            signature = self.signature(question)
+            candidates = np.flatnonzero(similarities >= self.threshold)
+            for best in candidates[np.argsort(-similarities[candidates], kind='stable')].tolist():
+                key = self._keys[best]
+                entry = self._entries[key]
+                if not self._same_question(signature, entry['signature']):
+                    self.rejected += 1
+                    continue
+
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return {
+                    'response': entry['response'],
+                    'tokens_used': entry['tokens_used'],
+                    'context_used': entry['context_used'],
+                    'context_length': entry['context_length'],
+                    'similarity': float(similarities[best])
+                }
+
+            self.misses += 1
+            return None
+
+    def put(self, vector: np.ndarray, question: str, version: int, result: Dict,
+            scope: Optional[Tuple[str, ...]] = None):
+        if self.capacity <= 0:
+            return
+
+        with self._lock:
+            # Answered from an index that has since changed: keep the newer entries and drop this one
+            if not self._reset_for(version):
+                return
+
+            self._entries[self._next_key] = {
+                'vector': self._unit(vector),
+                'signature': self.signature(question),
+                'scope': scope,
+                'response': result['response'],
+                'tokens_used': result.get('tokens_used', 0),
+                'context_used': result.get('context_used', False),
+                'context_length': result.get('context_length', 0)
+            }
+            self._next_key += 1
+
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'capacity': self.capacity,
+                'threshold': self.threshold,
+                'min_overlap': self.min_overlap,
+                'hits': self.hits,
+                'misses': self.misses,
+                'rejected_lexically': self.rejected
+            }
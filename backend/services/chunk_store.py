@@ -0,0 +1,354 @@
+import hashlib
+import json
+import mmap
+import os
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def chunk_key(text: str) -> bytes:
+    return hashlib.sha1(text.encode('utf-8')).digest()
+
+
+class ChunkTable:
+    IDS_FILE = 'chunk_ids.npy'
+    OFFSETS_FILE = 'chunk_offsets.npy'
+    DOCS_FILE = 'chunk_docs.npy'
+    INDEXES_FILE = 'chunk_index.npy'
+    PAGES_FILE = 'chunk_pages.npy'
+    PAGE_ENDS_FILE = 'chunk_page_ends.npy'
+    VECTORS_FILE = 'chunk_vectors.npy'
+    KEYS_FILE = 'chunk_keys.npy'
+    TEXT_FILE = 'chunks.bin'
+    DOCUMENTS_FILE = 'documents.json'
+
+    def __init__(self, directory: Optional[str] = None):
+        self.ids = np.empty(0, dtype='int64')
+        self.offsets = np.zeros(1, dtype='int64')
+        self.docs = np.empty(0, dtype='int32')
+        self.chunk_indexes = np.empty(0, dtype='int32')
+        self.pages = np.empty(0, dtype='int32')
+        self.page_ends = np.empty(0, dtype='int32')
+        self.vectors = None
+        self.keys = None
+        self.filenames = []
+        self.blob = b''
+        self._document_chunks = None
+
+        if directory:
+            self._open(directory)
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return os.path.exists(os.path.join(directory, ChunkTable.DOCUMENTS_FILE))
+
+    def _open(self, directory: str):
+        def column(name):
+            return np.load(os.path.join(directory, name), mmap_mode='r')
+
+        self.ids = column(self.IDS_FILE)
+        self.offsets = column(self.OFFSETS_FILE)
+        self.docs = column(self.DOCS_FILE)
+        self.chunk_indexes = column(self.INDEXES_FILE)
+        self.pages = column(self.PAGES_FILE)
+        # Stores written before chunks could span pages only have the first page
+        if os.path.exists(os.path.join(directory, self.PAGE_ENDS_FILE)):
+            self.page_ends = column(self.PAGE_ENDS_FILE)
+        else:
+            self.page_ends = self.pages
+        if os.path.exists(os.path.join(directory, self.VECTORS_FILE)):
+            self.vectors = column(self.VECTORS_FILE)
+        # Stores written before the keys were kept hash their texts on demand
+        if os.path.exists(os.path.join(directory, self.KEYS_FILE)):
+            self.keys = column(self.KEYS_FILE)
+
+        with open(os.path.join(directory, self.DOCUMENTS_FILE), 'r', encoding='utf-8') as f:
+            self.filenames = json.load(f)
+
+        with open(os.path.join(directory, self.TEXT_FILE), 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                self.blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.offsets) != len(self.ids) + 1:
+            raise ValueError(f"Chunk store is inconsistent: {len(self.ids)} ids, {len(self.offsets)} offsets")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def row(self, chunk_id: int) -> int:
+        row = int(np.searchsorted(self.ids, chunk_id))
+        if row < len(self.ids) and self.ids[row] == chunk_id:
+            return row
+        return -1
+
+    def text_bytes(self, row: int) -> bytes:
+        return bytes(self.blob[int(self.offsets[row]):int(self.offsets[row + 1])])
+
+    def key(self, row: int) -> bytes:
+        if self.keys is None:
+            return chunk_key(self.text_bytes(row).decode('utf-8'))
+        return self.keys[row].tobytes()
+
+    def metadata(self, row: int) -> Dict:
+        filename = self.filenames[self.docs[row]]
+        metadata = {
+            'filename': filename,
+            'chunk_index': int(self.chunk_indexes[row]),
+            'total_chunks': len(self.document_chunks[filename])
+        }
+        page = int(self.pages[row])
+        if page >= 0:
+            metadata['page'] = page
+            metadata['end_page'] = int(self.page_ends[row])
+        return metadata
+
+    @property
+    def document_chunks(self) -> Dict[str, np.ndarray]:
+        if self._document_chunks is None:
+            order = np.argsort(self.docs, kind='stable')
+            counts = np.bincount(self.docs, minlength=len(self.filenames))
+            groups = np.split(np.asarray(self.ids)[order], np.cumsum(counts)[:-1]) if len(self.filenames) else []
+            self._document_chunks = {
+                filename: ids for filename, ids in zip(self.filenames, groups) if len(ids)
+            }
+        return self._document_chunks
+
+
+class ChunkStore:
+    def __init__(self, table: Optional[ChunkTable] = None, pending: Optional[Dict[int, Tuple[str, Dict]]] = None,
+                 removed: frozenset = frozenset(), pending_vectors: Optional[Dict[int, np.ndarray]] = None):
+        self.table = table or ChunkTable()
+        self.pending = pending or {}
+        self.pending_vectors = pending_vectors or {}
+        self.removed = removed
+        self._document_chunks = None
+
+    @classmethod
+    def open(cls, directory: str) -> 'ChunkStore':
+        return cls(ChunkTable(directory))
+
+    def __len__(self) -> int:
+        return sum(len(ids) for ids in self.document_chunks.values())
+
+    def __contains__(self, chunk_id: int) -> bool:
+        if chunk_id in self.pending:
+            return True
+        return chunk_id not in self.removed and self.table.row(chunk_id) >= 0
+
+    def get(self, chunk_id: int) -> Optional[Tuple[str, Dict]]:
+        if chunk_id in self.pending:
+            return self.pending[chunk_id]
+        if chunk_id in self.removed:
+            return None
+
+        row = self.table.row(chunk_id)
+        if row < 0:
+            return None
+        return self.table.text_bytes(row).decode('utf-8'), self.table.metadata(row)
+
+    def key(self, chunk_id: int) -> bytes:
+        if chunk_id in self.pending:
+            return chunk_key(self.pending[chunk_id][0])
+        return self.table.key(self.table.row(chunk_id))
+
+    def chunk_keys(self) -> Dict[bytes, int]:
+        # chunk_key of every stored text, mapped to the first chunk holding it
+        keys = {}
+        for ids in self.document_chunks.values():
+            for chunk_id in ids:
+                keys.setdefault(self.key(int(chunk_id)), int(chunk_id))
+        return keys
+
+    def vectors(self, chunk_ids: np.ndarray) -> Optional[np.ndarray]:
+        vectors = []
+        for chunk_id in chunk_ids.tolist():
+            if chunk_id in self.pending_vectors:
+                vectors.append(self.pending_vectors[chunk_id])
+                continue
+            row = self.table.row(chunk_id)
+            if row < 0 or self.table.vectors is None:
+                return None
+            vectors.append(self.table.vectors[row])
+        return np.vstack(vectors) if vectors else np.empty((0, 0), dtype='float32')
+
+    @property
+    def document_chunks(self) -> Dict[str, List[int]]:
+        if self._document_chunks is None:
+            document_chunks = {}
+            for filename, ids in self.table.document_chunks.items():
+                kept = [chunk_id for chunk_id in ids.tolist() if chunk_id not in self.removed]
+                if kept:
+                    document_chunks[filename] = kept
+            for chunk_id, (_, metadata) in self.pending.items():
+                document_chunks.setdefault(metadata['filename'], []).append(chunk_id)
+            self._document_chunks = document_chunks
+        return self._document_chunks
+
+    def with_chunks(self, records: List[Tuple[int, str, Dict]], vectors: Optional[np.ndarray] = None) -> 'ChunkStore':
+        pending = dict(self.pending)
+        pending_vectors = dict(self.pending_vectors)
+        for i, (chunk_id, text, metadata) in enumerate(records):
+            pending[chunk_id] = (text, metadata)
+            if vectors is not None:
+                pending_vectors[chunk_id] = vectors[i]
+        return ChunkStore(self.table, pending, self.removed, pending_vectors)
+
+    def without(self, chunk_ids: List[int]) -> 'ChunkStore':
+        pending = dict(self.pending)
+        pending_vectors = dict(self.pending_vectors)
+        removed = set(self.removed)
+        for chunk_id in chunk_ids:
+            pending_vectors.pop(chunk_id, None)
+            if pending.pop(chunk_id, None) is None:
+                removed.add(chunk_id)
+        return ChunkStore(self.table, pending, frozenset(removed), pending_vectors)
+
+    def write(self, directory: str) -> 'ChunkStore':
+        os.makedirs(directory, exist_ok=True)
+
+        rows = []
+        for filename, ids in self.document_chunks.items():
+            rows.extend((chunk_id, filename) for chunk_id in ids)
+        rows.sort()
+
+        filenames = sorted(self.document_chunks)
+        doc_numbers = {filename: i for i, filename in enumerate(filenames)}
+
+        ids = np.empty(len(rows), dtype='int64')
+        offsets = np.zeros(len(rows) + 1, dtype='int64')
+        docs = np.empty(len(rows), dtype='int32')
+        chunk_indexes = np.empty(len(rows), dtype='int32')
+        pages = np.empty(len(rows), dtype='int32')
+        page_ends = np.empty(len(rows), dtype='int32')
+        keys = np.empty((len(rows), 20), dtype='uint8')
+
+        def tmp(name):
+            return os.path.join(directory, name + '.tmp')
+
+        has_vectors = bool(rows) and all(
+            chunk_id in self.pending_vectors if chunk_id in self.pending else self.table.vectors is not None
+            for chunk_id, _ in rows
+        )
+        vectors = None
+        if has_vectors:
+            dimension = len(next(iter(self.pending_vectors.values()))) if self.pending_vectors \
+                else self.table.vectors.shape[1]
+            vectors = np.lib.format.open_memmap(tmp(ChunkTable.VECTORS_FILE), mode='w+', dtype='float32',
+                                                shape=(len(rows), dimension))
+
+        with open(tmp(ChunkTable.TEXT_FILE), 'wb') as blob:
+            for i, (chunk_id, filename) in enumerate(rows):
+                if chunk_id in self.pending:
+                    text, metadata = self.pending[chunk_id]
+                    data = text.encode('utf-8')
+                    key = chunk_key(text)
+                    if vectors is not None:
+                        vectors[i] = self.pending_vectors[chunk_id]
+                else:
+                    row = self.table.row(chunk_id)
+                    data = self.table.text_bytes(row)
+                    key = self.table.key(row)
+                    metadata = {
+                        'chunk_index': int(self.table.chunk_indexes[row]),
+                        'page': int(self.table.pages[row]),
+                        'end_page': int(self.table.page_ends[row])
+                    }
+                    if vectors is not None:
+                        vectors[i] = self.table.vectors[row]
+
+                blob.write(data)
+                ids[i] = chunk_id
+                offsets[i + 1] = offsets[i] + len(data)
+                docs[i] = doc_numbers[filename]
+                chunk_indexes[i] = metadata['chunk_index']
+                pages[i] = metadata.get('page', -1)
+                page_ends[i] = metadata.get('end_page', pages[i])
+                keys[i] = np.frombuffer(key, dtype='uint8')
+
+        for name, array in ((ChunkTable.IDS_FILE, ids), (ChunkTable.OFFSETS_FILE, offsets),
+                            (ChunkTable.DOCS_FILE, docs), (ChunkTable.INDEXES_FILE, chunk_indexes),
+                            (ChunkTable.PAGES_FILE, pages), (ChunkTable.PAGE_ENDS_FILE, page_ends),
+                            (ChunkTable.KEYS_FILE, keys)):
+            with open(tmp(name), 'wb') as f:
+                np.save(f, array)
+
+        with open(tmp(ChunkTable.DOCUMENTS_FILE), 'w', encoding='utf-8') as f:
+            json.dump(filenames, f, ensure_ascii=False)
+
+        names = [ChunkTable.TEXT_FILE, ChunkTable.IDS_FILE, ChunkTable.OFFSETS_FILE, ChunkTable.DOCS_FILE,
+                 ChunkTable.INDEXES_FILE, ChunkTable.PAGES_FILE, ChunkTable.PAGE_ENDS_FILE, ChunkTable.KEYS_FILE,
+                 ChunkTable.DOCUMENTS_FILE]
+        if vectors is not None:
+            vectors.flush()
+            del vectors
+            names.append(ChunkTable.VECTORS_FILE)
+        elif os.path.exists(os.path.join(directory, ChunkTable.VECTORS_FILE)):
+            os.remove(os.path.join(directory, ChunkTable.VECTORS_FILE))
+
+        for name in names:
+            os.replace(tmp(name), os.path.join(directory, name))
+
+        return ChunkStore.open(directory)
+
+
+# A chunk whose text is already stored for another document is kept only as an extra source of the
+# stored copy: it has no row, vector or postings of its own.
+class ChunkAliases:
+    FILE = 'chunk_aliases.json'
+
+    def __init__(self, sources: Optional[Dict[int, Tuple[Dict, ...]]] = None):
+        self.sources = sources or {}
+        self._document_ids = None
+
+    def __len__(self) -> int:
+        return sum(len(sources) for sources in self.sources.values())
+
+    def get(self, chunk_id: int) -> Tuple[Dict, ...]:
+        return self.sources.get(chunk_id, ())
+
+    @property
+    def document_ids(self) -> Dict[str, List[int]]:
+        # Stored chunk ids each document refers to through an alias
+        if self._document_ids is None:
+            document_ids = {}
+            for chunk_id, sources in self.sources.items():
+                for metadata in sources:
+                    document_ids.setdefault(metadata['filename'], []).append(chunk_id)
+            self._document_ids = document_ids
+        return self._document_ids
+
+    def with_sources(self, added: Dict[int, List[Dict]]) -> 'ChunkAliases':
+        if not added:
+            return self
+        sources = dict(self.sources)
+        for chunk_id, metadata in added.items():
+            sources[chunk_id] = sources.get(chunk_id, ()) + tuple(metadata)
+        return ChunkAliases(sources)
+
+    def without_document(self, filename: str) -> 'ChunkAliases':
+        if filename not in self.document_ids:
+            return self
+        sources = {}
+        for chunk_id, chunk_sources in self.sources.items():
+            kept = tuple(metadata for metadata in chunk_sources if metadata['filename'] != filename)
+            if kept:
+                sources[chunk_id] = kept
+        return ChunkAliases(sources)
+
+    def without(self, chunk_ids: Iterable[int]) -> 'ChunkAliases':
+        sources = dict(self.sources)
+        for chunk_id in chunk_ids:
+            sources.pop(chunk_id, None)
+        return ChunkAliases(sources)
+
+    def write(self, path: str):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({str(chunk_id): list(sources) for chunk_id, sources in self.sources.items()}, f,
+                      ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'ChunkAliases':
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls({int(chunk_id): tuple(sources) for chunk_id, sources in json.load(f).items()})
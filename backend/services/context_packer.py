@@ -0,0 +1,116 @@
+import math
+from typing import Dict, List, Optional, Tuple
+import config
+
+SEPARATOR = "\n---\n"
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / config.CONTEXT_CHARS_PER_TOKEN) if text else 0
+
+
+def _pages(first_page: Optional[int], last_page: Optional[int]) -> str:
+    if first_page is None:
+        return ''
+    return f", с. {first_page}" if first_page == last_page else f", с. {first_page}-{last_page}"
+
+
+def _format(filename: str, text: str, first_page: Optional[int] = None, last_page: Optional[int] = None) -> str:
+    return f"[Документ: {filename}{_pages(first_page, last_page)}]\n{text}\n"
+
+
+def _join_overlapping(left: str, right: str, max_overlap: int) -> str:
+    # chunk_text repeats up to CHUNK_OVERLAP characters (minus stripped whitespace) at the start of the next chunk
+    probe = right[:min(32, len(right))]
+    if probe:
+        pos = left.find(probe, max(0, len(left) - max_overlap - len(probe)))
+        while pos != -1:
+            if right.startswith(left[pos:]):
+                return left[:pos] + right
+            pos = left.find(probe, pos + 1)
+    return f"{left}\n{right}"
+
+
+def _truncate(text: str, max_chars: int) -> str:
+    cut = text[:max_chars]
+    boundary = max(cut.rfind('.'), cut.rfind('\n'))
+    return cut[:boundary + 1] if boundary > max_chars * 0.5 else cut
+
+
+class ContextPacker:
+    def __init__(self, token_budget: int, min_similarity: float, max_overlap: int):
+        self.token_budget = token_budget
+        self.min_similarity = min_similarity
+        self.max_overlap = max_overlap
+
+    def _merge(self, results: List[Dict]) -> List[Tuple]:
+        # Runs of consecutive chunks from one document become one segment, ranked by its best hit
+        by_document = {}
+        for rank, result in enumerate(results):
+            metadata = result['metadata']
+            by_document.setdefault(metadata['filename'], []).append((
+                metadata['chunk_index'], rank, result['text'], metadata.get('page'), metadata.get('end_page')
+            ))
+
+        segments = []
+        for filename, chunks in by_document.items():
+            chunks.sort(key=lambda chunk: chunk[0])
+            chunk_index, rank, text, first_page, last_page = chunks[0]
+            for next_index, next_rank, next_text, next_first, next_last in chunks[1:]:
+                if next_index == chunk_index + 1:
+                    text = _join_overlapping(text, next_text, self.max_overlap)
+                    rank = min(rank, next_rank)
+                    last_page = next_last
+                else:
+                    segments.append((rank, filename, text, first_page, last_page))
+                    rank, text, first_page, last_page = next_rank, next_text, next_first, next_last
+                chunk_index = next_index
+            segments.append((rank, filename, text, first_page, last_page))
+
+        segments.sort(key=lambda segment: segment[0])
+        return segments
+
+    def pack(self, results: List[Dict]) -> Tuple[str, Dict]:
+        raw_tokens = estimate_tokens(SEPARATOR.join(
+            _format(r['metadata']['filename'], r['text'], r['metadata'].get('page'), r['metadata'].get('end_page'))
+            for r in results
+        ))
+
+        relevant = [
+            r for r in results
+            if r.get('similarity') is None or r['similarity'] >= self.min_similarity
+        ]
+        segments = self._merge(relevant)
+
+        parts = []
+        used = 0
+        truncated = 0
+        for _, filename, text, first_page, last_page in segments:
+            part = _format(filename, text, first_page, last_page)
+            cost = estimate_tokens(part) + (estimate_tokens(SEPARATOR) if parts else 0)
+            if used + cost > self.token_budget:
+                header = _format(filename, '', first_page, last_page)
+                remaining = self.token_budget - used - estimate_tokens(header + SEPARATOR)
+                if remaining < 50:
+                    break
+                part = _format(filename, _truncate(text, int(remaining * config.CONTEXT_CHARS_PER_TOKEN)),
+                               first_page, last_page)
+                cost = estimate_tokens(part) + (estimate_tokens(SEPARATOR) if parts else 0)
+                truncated += 1
+            parts.append(part)
+            used += cost
+            if truncated:
+                break
+
+        context = SEPARATOR.join(parts)
+        tokens = estimate_tokens(context)
+        return context, {
+            'hits': len(results),
+            'dropped_low_relevance': len(results) - len(relevant),
+            'merged_chunks': len(relevant) - len(segments),
+            'segments': len(parts),
+            'truncated': truncated,
+            'raw_tokens': raw_tokens,
+            'tokens': tokens,
+            'tokens_saved': raw_tokens - tokens
+        }
@@ -0,0 +1,67 @@
+import atexit
+import multiprocessing
+import threading
+import time
+import numpy as np
+from typing import List
+
+_worker_model = None
+
+
+def _init_worker(model_name: str, backend: str, threads: int):
+    global _worker_model
+    import torch
+    from .encoders import load_model
+
+    torch.set_num_threads(threads)
+    _worker_model, _ = load_model(model_name, backend)
+
+
+def _encode_batch(texts: List[str]) -> np.ndarray:
+    return _worker_model.encode(texts, convert_to_numpy=True).astype('float32')
+
+
+class CorpusEncoder:
+    def __init__(self, model, model_name: str, backend: str, workers: int, threads_per_worker: int, batch_size: int,
+                 min_parallel_chunks: int = 0):
+        self.model = model
+        self.model_name = model_name
+        self.backend = backend
+        self.workers = max(1, workers)
+        self.threads_per_worker = max(1, threads_per_worker)
+        self.batch_size = max(1, batch_size)
+        self.min_parallel_chunks = min_parallel_chunks
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self):
+        # Started on the first large encode and kept, so the workers load the model once per process
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = multiprocessing.get_context('spawn').Pool(
+                    self.workers, initializer=_init_worker,
+                    initargs=(self.model_name, self.backend, self.threads_per_worker)
+                )
+                atexit.register(self._pool.terminate)
+            return self._pool
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        start = time.perf_counter()
+        workers = 1
+
+        if self.workers == 1 or len(batches) == 1 or len(texts) < self.min_parallel_chunks:
+            results = [self.model.encode(batch, convert_to_numpy=True).astype('float32') for batch in batches]
+        else:
+            results = []
+            workers = self.workers
+            for vectors in self._get_pool().imap(_encode_batch, batches):
+                results.append(vectors)
+                done = sum(len(r) for r in results)
+                print(f"Encoded {done}/{len(texts)} chunks")
+
+        elapsed = time.perf_counter() - start
+        print(f"Encoded {len(texts)} chunks in {elapsed:.1f}s "
+              f"({len(texts) / elapsed if elapsed else 0:.1f} chunks/sec, {workers} workers)")
+
+        return np.vstack(results) if results else np.empty((0, 0), dtype='float32')
@@ -38,13 +38,18 @@ class DatabaseService:
         stats.save()
     
     @staticmethod
-    def add_document(filename: str, content: str, file_path: str, pages_count: int) -> Document:
+    def add_document(filename: str, content: str, file_path: str, pages_count: int,
+                     content_hash: Optional[str] = None, parse_method: Optional[str] = None,
+                     parse_stats: Optional[str] = None) -> Document:
         with db.atomic():
             doc = Document.create(
                 filename=filename,
                 content=content,
                 file_path=file_path,
-                pages_count=pages_count
+                pages_count=pages_count,
+                content_hash=content_hash,
+                parse_method=parse_method,
+                parse_stats=parse_stats
             )
             return doc
     
@@ -54,6 +59,10 @@ class DatabaseService:
             return Document.get(Document.filename == filename)
         except DoesNotExist:
             return None
+
+    @staticmethod
+    def get_document_by_hash(content_hash: str) -> Optional[Document]:
+        return Document.get_or_none(Document.content_hash == content_hash)
     
     @staticmethod
     def delete_document(filename: str) -> bool:
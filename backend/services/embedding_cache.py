@@ -0,0 +1,88 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from typing import Dict, Iterable, List, Tuple
+
+SQL_BATCH = 500
+
+
+class EmbeddingCache:
+    def __init__(self, path: str, model_key: str, dimension: int, max_entries: int):
+        self.path = path
+        self.model_key = model_key
+        self.dimension = dimension
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings ('
+            'key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+        self._conn.commit()
+
+    def key(self, text: str) -> bytes:
+        return hashlib.sha256(f"{self.model_key}\0{text}".encode('utf-8')).digest()
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        now = time.time()
+
+        with self._lock:
+            for i in range(0, len(unique), SQL_BATCH):
+                batch = unique[i:i + SQL_BATCH]
+                placeholders = ','.join('?' * len(batch))
+                rows = self._conn.execute(
+                    f'SELECT key, vector FROM embeddings WHERE key IN ({placeholders})', batch
+                ).fetchall()
+                for key, vector in rows:
+                    # Vectors written for another model size are treated as misses and overwritten by put_many
+                    if len(vector) == self.dimension * 4:
+                        found[key] = np.frombuffer(vector, dtype='float32')
+                self._conn.execute(
+                    f'UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})', [now] + batch
+                )
+            self._conn.commit()
+
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+
+        return found
+
+    def put_many(self, items: Iterable[Tuple[bytes, np.ndarray]]):
+        now = time.time()
+        rows = [(key, np.asarray(vector, dtype='float32').tobytes(), now) for key, vector in items]
+
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)', rows)
+
+            overflow = self._count() - self.max_entries
+            if self.max_entries > 0 and overflow > 0:
+                self._conn.execute(
+                    'DELETE FROM embeddings WHERE key IN '
+                    '(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)', (overflow,)
+                )
+            self._conn.commit()
+
+    def _count(self) -> int:
+        return self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            entries = self._count()
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'size_mb': round(os.path.getsize(self.path) / 1024 / 1024, 2) if os.path.exists(self.path) else 0,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0
+        }
@@ -1,152 +1,912 @@
 import numpy as np
 import faiss
+import json
 import pickle
 import os
-from sentence_transformers import SentenceTransformer
-from typing import List, Tuple, Dict
+import shutil
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Dict
+from .chunk_store import ChunkAliases, ChunkStore, ChunkTable, chunk_key
+from .sharded_index import ShardedIndex
+from .snapshot_store import SnapshotStore
+from .query_batcher import QueryBatcher
+from .corpus_encoder import CorpusEncoder
+from .embedding_cache import EmbeddingCache
+from .encoders import load_model
+from .lexical_index import LexicalIndex
+from .context_packer import ContextPacker
 import config
 
+
+class IndexSnapshot:
+    def __init__(self, index: ShardedIndex, store: ChunkStore, lexical: LexicalIndex, next_id: int = 0,
+                 version: int = 0, aliases: Optional[ChunkAliases] = None,
+                 chunk_keys: Optional[Dict[bytes, int]] = None):
+        self.index = index
+        self.store = store
+        self.lexical = lexical
+        self.next_id = next_id
+        self.version = version
+        self.aliases = aliases or ChunkAliases()
+        self._chunk_keys = chunk_keys
+        self._document_ranges = None
+
+    @property
+    def document_chunks(self) -> Dict[str, List[int]]:
+        return self.store.document_chunks
+
+    @property
+    def documents(self) -> List[str]:
+        return list(self.document_chunks) + [
+            name for name in self.aliases.document_ids if name not in self.document_chunks
+        ]
+
+    @property
+    def chunk_keys(self) -> Dict[bytes, int]:
+        if self._chunk_keys is None:
+            self._chunk_keys = self.store.chunk_keys()
+        return self._chunk_keys
+
+    def shared_ids(self, documents: List[str]) -> np.ndarray:
+        # Stored chunks that the given documents only hold through an alias of another document's copy
+        wanted = set(documents)
+        ids = set()
+        for name in documents:
+            for chunk_id in self.aliases.document_ids.get(name, ()):
+                chunk = self.store.get(chunk_id)
+                if chunk and chunk[1]['filename'] not in wanted:
+                    ids.add(chunk_id)
+        return np.array(sorted(ids), dtype='int64')
+
+    # Chunk ids are handed out consecutively per upload, so each document is a few [start, end) runs
+    @property
+    def document_ranges(self) -> Dict[str, np.ndarray]:
+        if self._document_ranges is None:
+            ranges = {}
+            for filename, ids in self.document_chunks.items():
+                ids = np.sort(np.asarray(ids, dtype='int64'))
+                breaks = np.flatnonzero(np.diff(ids) != 1) + 1
+                starts = ids[np.concatenate([[0], breaks])]
+                ends = ids[np.concatenate([breaks - 1, [len(ids) - 1]])] + 1
+                ranges[filename] = np.stack([starts, ends], axis=1)
+            self._document_ranges = ranges
+        return self._document_ranges
+
+
+class QueryEmbeddingCache:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return re.sub(r'\s+', ' ', query.casefold()).strip(' .,!?;:')
+
+    def get(self, key: str):
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, key: str, vector: np.ndarray):
+        if self.capacity <= 0:
+            return
+        vector.flags.writeable = False
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
 class EmbeddingsService:
+    MODEL_NAME = config.EMBEDDINGS_MODEL
+
     def __init__(self):
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.dimension = 384
-        self.index = None
-        self.chunks = []
-        self.chunk_metadata = []
-        
+        self.model, self.backend = load_model(self.MODEL_NAME)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self._snapshot = None
+        self._write_lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._save_condition = threading.Condition()
+        self._save_requested = 0
+        self._save_completed = 0
+        self._save_thread = None
+        self.last_save = None
+        self.corpus_encoder = CorpusEncoder(
+            self.model,
+            self.MODEL_NAME,
+            self.backend,
+            config.ENCODE_WORKERS,
+            config.ENCODE_THREADS_PER_WORKER,
+            config.ENCODE_BATCH_SIZE,
+            config.ENCODE_PARALLEL_MIN_CHUNKS
+        )
+        self.last_rebuild = None
+        self.embedding_cache = EmbeddingCache(
+            os.path.join(config.EMBEDDINGS_DIR, 'embedding_cache.db'),
+            f"{self.MODEL_NAME}:{self.backend}",
+            self.dimension,
+            config.EMBEDDING_CACHE_MAX_ENTRIES
+        )
+        self.query_cache = QueryEmbeddingCache(config.QUERY_CACHE_SIZE)
+        self.context_packer = ContextPacker(config.CONTEXT_MAX_TOKENS, config.CONTEXT_MIN_SIMILARITY,
+                                            config.CHUNK_OVERLAP)
+        self.context_stats = {'requests': 0, 'tokens': 0, 'tokens_saved': 0, 'dropped_low_relevance': 0}
+        self._context_stats_lock = threading.Lock()
+        self.query_batcher = None
+        if config.QUERY_BATCH_WINDOW_MS > 0:
+            self.query_batcher = QueryBatcher(
+                lambda texts: self.model.encode(texts, convert_to_numpy=True),
+                config.QUERY_BATCH_WINDOW_MS,
+                config.QUERY_BATCH_MAX
+            )
+
+        self.snapshots = SnapshotStore(config.EMBEDDINGS_DIR)
+
+        # Layouts written by earlier versions; migrated into a snapshot on first load
         self.index_path = os.path.join(config.EMBEDDINGS_DIR, 'faiss_index.bin')
+        self.store_dir = os.path.join(config.EMBEDDINGS_DIR, 'chunk_store')
+        self.lexical_path = os.path.join(config.EMBEDDINGS_DIR, LexicalIndex.FILE)
+        self.shards_manifest_path = os.path.join(self.snapshots.shards_dir, 'shards.json')
         self.chunks_path = os.path.join(config.EMBEDDINGS_DIR, 'chunks.pkl')
         self.metadata_path = os.path.join(config.EMBEDDINGS_DIR, 'metadata.pkl')
-        
+
         self._load_or_create_index()
-    
+
+    # Readers grab the current snapshot once and never see it change underneath them;
+    # writers build a new snapshot and swap the reference.
+    @property
+    def snapshot(self) -> IndexSnapshot:
+        return self._snapshot
+
+    @property
+    def index(self):
+        return self._snapshot.index
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    def _publish(self, index: ShardedIndex, store: ChunkStore, lexical: LexicalIndex, next_id: int,
+                 aliases: Optional[ChunkAliases] = None, chunk_keys: Optional[Dict[bytes, int]] = None):
+        version = self._snapshot.version + 1 if self._snapshot else 0
+        self._snapshot = IndexSnapshot(index, store, lexical, next_id, version, aliases, chunk_keys)
+
+    @staticmethod
+    def _chunk_texts(store: ChunkStore, ids):
+        for chunk_id in ids:
+            chunk = store.get(chunk_id)
+            if chunk:
+                yield chunk_id, chunk[0]
+
+    def _build_lexical_index(self, store: ChunkStore) -> LexicalIndex:
+        ids = [chunk_id for chunk_ids in store.document_chunks.values() for chunk_id in chunk_ids]
+        return LexicalIndex.build(self._chunk_texts(store, ids))
+
     def _load_or_create_index(self):
-        if os.path.exists(self.index_path) and os.path.exists(self.chunks_path):
-            try:
-                self.index = faiss.read_index(self.index_path)
-                with open(self.chunks_path, 'rb') as f:
-                    self.chunks = pickle.load(f)
-                with open(self.metadata_path, 'rb') as f:
-                    self.chunk_metadata = pickle.load(f)
-                print(f"Loaded existing index with {len(self.chunks)} chunks")
-            except Exception as e:
-                print(f"Error loading index: {e}, creating new one")
+        loaded = self.snapshots.load()
+        if loaded:
+            index, store, lexical, aliases, manifest = loaded
+            self._publish(index, store, lexical or self._build_lexical_index(store), manifest['next_id'], aliases)
+            print(f"Loaded index snapshot {manifest['generation']} with {len(store)} chunks "
+                  f"in {len(index.shards)} shards")
+            return
+
+        try:
+            if os.path.exists(self.shards_manifest_path) and ChunkTable.exists(self.store_dir):
+                with open(self.shards_manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                store = ChunkStore.open(self.store_dir)
+                index = ShardedIndex.open(self.snapshots.shards_dir, manifest['dimension'], manifest['shards'])
+            elif os.path.exists(self.index_path) and ChunkTable.exists(self.store_dir):
+                store = ChunkStore.open(self.store_dir)
+                index = self._shard_legacy_index(faiss.read_index(self.index_path), store)
+            elif os.path.exists(self.index_path) and os.path.exists(self.chunks_path):
+                index, store = self._read_pickled_index()
+            else:
+                stale = [p for p in (self.chunks_path, self.metadata_path) if os.path.exists(p)]
+                if stale:
+                    print(f"Ignoring {', '.join(map(os.path.basename, stale))} without a matching FAISS index")
                 self._create_new_index()
-        else:
+                return
+        except Exception as e:
+            print(f"Error migrating index: {e}, creating new one")
             self._create_new_index()
+            return
+
+        next_id = max((max(ids) for ids in store.document_chunks.values()), default=-1) + 1
+        self._publish(index, store, self._build_lexical_index(store), next_id)
+        if self._persist(self._snapshot):
+            self._remove_legacy_files()
+            print(f"Migrated {len(store)} chunks into index snapshot {self.snapshots.generation}")
 
     def _create_new_index(self):
-        self.index = faiss.IndexFlatL2(self.dimension)
-        self.chunks = []
-        self.chunk_metadata = []
+        self._publish(ShardedIndex(self.dimension), ChunkStore(), LexicalIndex(), 0)
         print("Created new FAISS index")
 
-    def add_document(self, text: str, filename: str, chunk_size: int = 1000, overlap: int = 200):
+    def _shard_legacy_index(self, legacy, store: ChunkStore) -> ShardedIndex:
+        def vectors_for(ids):
+            vectors = store.vectors(ids)
+            return vectors if vectors is not None else legacy.reconstruct_batch(ids)
+
+        return ShardedIndex.from_chunks(self.dimension, store.document_chunks, vectors_for)
+
+    def _read_pickled_index(self) -> Tuple[ShardedIndex, ChunkStore]:
+        index = faiss.read_index(self.index_path)
+        with open(self.chunks_path, 'rb') as f:
+            chunks = pickle.load(f)
+        with open(self.metadata_path, 'rb') as f:
+            chunk_metadata = pickle.load(f)
+
+        # The oldest indexes were plain IndexFlatL2 addressed by list position
+        if isinstance(chunks, list):
+            id_index = faiss.IndexIDMap2(faiss.IndexFlatL2(index.d))
+            if index.ntotal:
+                id_index.add_with_ids(index.reconstruct_n(0, index.ntotal), np.arange(index.ntotal, dtype='int64'))
+            index, chunks, chunk_metadata = id_index, dict(enumerate(chunks)), dict(enumerate(chunk_metadata))
+
+        ids = sorted(chunks)
+        vectors = index.reconstruct_batch(np.array(ids, dtype='int64')) if ids else None
+
+        store = ChunkStore().with_chunks([
+            (chunk_id, chunks[chunk_id], chunk_metadata[chunk_id]) for chunk_id in ids
+        ], vectors)
+        return self._shard_legacy_index(index, store), store
+
+    def _remove_legacy_files(self):
+        for path in (self.index_path, self.lexical_path, self.shards_manifest_path, self.chunks_path,
+                     self.metadata_path):
+            if os.path.exists(path):
+                os.remove(path)
+        shutil.rmtree(self.store_dir, ignore_errors=True)
+
+    @staticmethod
+    def _iter_chunks(text: str, chunk_size: int, overlap: int,
+                     pages_count: Optional[int] = None) -> Iterator[Tuple[str, Optional[int], Optional[int]]]:
+        from .file_parser import FileParser, PAGE_BREAK
+
+        # Text stored before page breaks were kept has a single "page" that says nothing about the PDF
+        if pages_count:
+            paged = text.count(PAGE_BREAK) + 1 == int(pages_count)
+        else:
+            paged = PAGE_BREAK in text
+
+        for chunk, first_page, last_page in FileParser.iter_chunks(FileParser.split_pages(text), chunk_size, overlap):
+            yield (chunk, first_page, last_page) if paged else (chunk, None, None)
+
+    def _encode_stream(self, chunks: Iterable[Tuple],
+                       progress: Optional[Callable[[int], None]] = None) -> Tuple[List[Tuple], np.ndarray]:
+        encoded = []
+        batch = []
+        vectors = []
+
+        reused = 0
+
+        # Batches are encoded as soon as the chunker fills them, so only chunks and their vectors accumulate
+        for chunk in chunks:
+            encoded.append(chunk)
+            batch.append(chunk[0])
+            if len(batch) == config.ENCODE_BATCH_SIZE:
+                batch_vectors, batch_reused = self._encode_cached(batch)
+                vectors.append(batch_vectors)
+                reused += batch_reused
+                batch = []
+                if progress:
+                    progress(len(encoded))
+        if batch:
+            batch_vectors, batch_reused = self._encode_cached(batch)
+            vectors.append(batch_vectors)
+            reused += batch_reused
+            if progress:
+                progress(len(encoded))
+
+        if encoded:
+            print(f"Embedding cache: {reused} of {len(encoded)} chunks reused")
+        return encoded, np.vstack(vectors) if vectors else np.empty((0, self.dimension), dtype='float32')
+
+    def encode_pages(self, pages: Iterable[str],
+                     progress: Optional[Callable[[int], None]] = None) -> Tuple[List[Tuple], np.ndarray]:
+        # pages may be a live parser generator; the chunker pulls one page at a time from it
         from .file_parser import FileParser
 
-        chunks = FileParser.chunk_text(text, chunk_size, overlap)
+        return self._encode_stream(FileParser.iter_chunks(pages, config.CHUNK_SIZE, config.CHUNK_OVERLAP), progress)
+
+    def _encode_document(self, text: str, filename: str, chunk_size: int, overlap: int,
+                         pages_count: Optional[int] = None) -> Tuple[List[Tuple], np.ndarray]:
+        try:
+            chunks, vectors = self._encode_stream(self._iter_chunks(text, chunk_size, overlap, pages_count))
+        except ValueError as e:
+            print(e)
+            return [], None
 
         if not chunks:
             print(f"No chunks created for {filename}")
-            return
+            return [], None
 
-        embeddings = self.model.encode(chunks, convert_to_numpy=True)
+        return chunks, vectors
 
-        if embeddings.shape[1] != self.dimension:
-            print(f"Dimension mismatch: expected {self.dimension}, got {embeddings.shape[1]}")
-            return
+    def _encode_cached(self, texts: List[str], parallel: bool = False) -> Tuple[np.ndarray, int]:
+        keys = [self.embedding_cache.key(text) for text in texts]
+        cached = self.embedding_cache.get_many(keys)
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+
+        vectors = np.empty((len(texts), self.dimension), dtype='float32')
+        for i, key in enumerate(keys):
+            if key in cached:
+                vectors[i] = cached[key]
+
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            if parallel:
+                encoded = self.corpus_encoder.encode(missing_texts)
+            else:
+                encoded = self.model.encode(missing_texts, convert_to_numpy=True).astype('float32')
+
+            if encoded.shape[1] != self.dimension:
+                raise ValueError(f"Dimension mismatch: expected {self.dimension}, got {encoded.shape[1]}")
+
+            vectors[missing] = encoded
+            self.embedding_cache.put_many((keys[i], encoded[row]) for row, i in enumerate(missing))
 
-        self.index.add(embeddings.astype('float32'))
+        return vectors, len(texts) - len(missing)
 
-        for i, chunk in enumerate(chunks):
-            self.chunks.append(chunk)
-            self.chunk_metadata.append({
+    def _encode_chunks(self, texts: List[str], parallel: bool = False) -> np.ndarray:
+        vectors, reused = self._encode_cached(texts, parallel)
+        print(f"Embedding cache: {reused} of {len(texts)} chunks reused")
+        return vectors
+
+    @staticmethod
+    def _chunk_records(next_id: int, chunks: List[Tuple[str, Optional[int], Optional[int]]],
+                       filename: str) -> List[Tuple[int, str, Dict]]:
+        records = []
+        for i, (chunk, first_page, last_page) in enumerate(chunks):
+            metadata = {
                 'filename': filename,
                 'chunk_index': i,
                 'total_chunks': len(chunks)
-            })
+            }
+            if first_page is not None:
+                metadata['page'] = first_page
+                metadata['end_page'] = last_page
+            records.append((next_id + i, chunk, metadata))
+        return records
+
+    @staticmethod
+    def _split_duplicates(records: List[Tuple[int, str, Dict]], keys: Dict[bytes, int]
+                          ) -> Tuple[List[int], List[Tuple[int, str, Dict]], Dict[int, List[Dict]]]:
+        # Records whose text is already stored become aliases of that chunk; the rest are renumbered
+        # consecutively from the first record's id. keys is updated in place.
+        first_id = records[0][0] if records else 0
+        rows = []
+        unique = []
+        duplicates = {}
+        for row, (_, text, metadata) in enumerate(records):
+            key = chunk_key(text)
+            stored = keys.get(key)
+            if stored is None:
+                keys[key] = first_id + len(unique)
+                rows.append(row)
+                unique.append((first_id + len(unique), text, metadata))
+            else:
+                duplicates.setdefault(stored, []).append(metadata)
+        return rows, unique, duplicates
+
+    def add_document(self, text: str, filename: str, chunk_size: int = 1000, overlap: int = 200,
+                     pages_count: Optional[int] = None):
+        chunks, embeddings = self._encode_document(text, filename, chunk_size, overlap, pages_count)
+
+        if not chunks:
+            return
+
+        self.publish_document(filename, chunks, embeddings)
+
+    def _publish_state(self, state: IndexSnapshot):
+        self._publish(state.index, state.store, state.lexical, state.next_id, state.aliases, state._chunk_keys)
+
+    def _with_document(self, current: IndexSnapshot, filename: str, chunks: List[Tuple],
+                       embeddings: np.ndarray) -> Tuple[IndexSnapshot, int]:
+        keys = dict(current.chunk_keys)
+        rows, records, duplicates = self._split_duplicates(
+            self._chunk_records(current.next_id, chunks, filename), keys
+        )
+        embeddings = embeddings[rows]
+
+        index = current.index
+        store = current.store.with_chunks(records, embeddings)
+        if records:
+            ids = np.array([r[0] for r in records], dtype='int64')
+            index = index.with_vectors(filename, embeddings, ids)
+            if index.needs_template():
+                index = self._train_shards(store) or index
+
+        state = IndexSnapshot(
+            index,
+            store,
+            current.lexical.with_chunks((r[0], r[1]) for r in records),
+            current.next_id + len(records),
+            current.version,
+            current.aliases.with_sources(duplicates),
+            keys
+        )
+        return state, len(records)
+
+    def _without_document(self, current: IndexSnapshot, filename: str) -> Tuple[IndexSnapshot, int, int]:
+        ids = current.document_chunks.get(filename, [])
+        aliases = current.aliases.without_document(filename)
+        shared = len(current.aliases) - len(aliases)
+        if not ids and not shared:
+            return current, 0, 0
+
+        index = current.index.without(filename)
+        store = current.store.without(ids)
+        lexical = current.lexical.without(self._chunk_texts(current.store, ids))
+        next_id = current.next_id
 
-        print(f"Added {len(chunks)} chunks from {filename}")
-    
-    def search(self, query: str, top_k: int = 5) -> List[Dict]:
-        if self.index.ntotal == 0:
+        keys = dict(current.chunk_keys)
+        for chunk_id in ids:
+            key = current.store.key(int(chunk_id))
+            if keys.get(key) == chunk_id:
+                del keys[key]
+
+        # Chunks other documents share move to the first of them instead of disappearing
+        inherited = {}
+        for chunk_id in ids:
+            sources = aliases.get(chunk_id)
+            if sources:
+                inherited.setdefault(sources[0]['filename'], []).append((chunk_id, sources))
+
+        moved = {}
+        for owner, chunks in inherited.items():
+            old_ids = np.array([chunk_id for chunk_id, _ in chunks], dtype='int64')
+            texts = [current.store.get(chunk_id)[0] for chunk_id, _ in chunks]
+            vectors = current.store.vectors(old_ids)
+            if vectors is None:
+                vectors = self._encode_chunks(texts)
+
+            records = []
+            for (_, sources), text in zip(chunks, texts):
+                records.append((next_id, text, sources[0]))
+                keys[chunk_key(text)] = next_id
+                if len(sources) > 1:
+                    moved[next_id] = list(sources[1:])
+                next_id += 1
+
+            index = index.with_vectors(owner, vectors, np.array([r[0] for r in records], dtype='int64'))
+            store = store.with_chunks(records, vectors)
+            lexical = lexical.with_chunks((r[0], r[1]) for r in records)
+
+        state = IndexSnapshot(index, store, lexical, next_id, current.version,
+                              aliases.without(ids).with_sources(moved), keys)
+        return state, len(ids), shared
+
+    def publish_document(self, filename: str, chunks: List[Tuple], embeddings: np.ndarray):
+        with self._write_lock:
+            state, added = self._with_document(self._snapshot, filename, chunks, embeddings)
+            self._publish_state(state)
+
+        shared = len(chunks) - added
+        print(f"Added {added} chunks from {filename}" + (f", {shared} already stored" if shared else ''))
+
+    def _train_shards(self, store: ChunkStore) -> Optional[ShardedIndex]:
+        # The corpus outgrew the configured index type's template (or had none yet): every shard is rebuilt
+        # from the stored vectors on a template trained over all of them
+        start = time.time()
+        ids = np.sort(np.array([i for chunk_ids in store.document_chunks.values() for i in chunk_ids],
+                               dtype='int64'))
+        vectors = store.vectors(ids)
+        if vectors is None:
+            return None
+        index = ShardedIndex.from_chunks(self.dimension, store.document_chunks,
+                                         lambda chunk_ids: vectors[np.searchsorted(ids, chunk_ids)])
+        print(f"Trained shared {config.INDEX_TYPE} template on {index.ntotal} vectors "
+              f"and rebuilt {len(index.shards)} shards in {time.time() - start:.1f}s")
+        return index
+
+    def remove_document(self, filename: str) -> int:
+        with self._write_lock:
+            state, removed, shared = self._without_document(self._snapshot, filename)
+            if not removed and not shared:
+                print(f"No chunks indexed for {filename}")
+                return 0
+            self._publish_state(state)
+
+        print(f"Removed {removed} chunks of {filename}" + (f" and {shared} shared ones" if shared else ''))
+        return removed + shared
+
+    def replace_document(self, filename: str, chunks: List[Tuple], embeddings: np.ndarray):
+        # One publish for both steps, so readers see the old or the new version and never neither
+        with self._write_lock:
+            state, removed, shared = self._without_document(self._snapshot, filename)
+            added = 0
+            if chunks:
+                state, added = self._with_document(state, filename, chunks, embeddings)
+            self._publish_state(state)
+
+        print(f"Replaced {removed + shared} chunks of {filename} with {len(chunks)}"
+              + (f", {len(chunks) - added} already stored" if len(chunks) > added else ''))
+
+    def encode_query(self, query: str) -> np.ndarray:
+        key = QueryEmbeddingCache.normalize(query)
+        vector = self.query_cache.get(key)
+
+        if vector is None:
+            if self.query_batcher:
+                vector = self.query_batcher.encode(query)
+            else:
+                vector = self.model.encode([query], convert_to_numpy=True).astype('float32')
+            self.query_cache.put(key, vector)
+
+        return vector
+
+    def _vector_search(self, snapshot: IndexSnapshot, query_vector: np.ndarray, top_k: int,
+                       documents: List[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        distances, indices = snapshot.index.search(
+            query_vector,
+            top_k,
+            config.INDEX_RERANK,
+            snapshot.store.vectors,
+            documents
+        )
+        ids, distances = indices[0], distances[0]
+
+        # Shared chunks live in another document's shard, so they are scored directly
+        shared = snapshot.shared_ids(documents) if documents is not None else None
+        if shared is not None and len(shared):
+            vectors = snapshot.store.vectors(shared)
+            if vectors is not None:
+                ids = np.concatenate([ids, shared])
+                distances = np.concatenate([distances, ((vectors - query_vector) ** 2).sum(axis=1)])
+                order = np.argsort(distances, kind='stable')[:top_k]
+                ids, distances = ids[order], distances[order]
+
+        return ids, distances
+
+    def _lexical_search(self, snapshot: IndexSnapshot, query: str, top_k: int,
+                        documents: List[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        ranges = None
+        if documents is not None:
+            shared = snapshot.shared_ids(documents)
+            ranges = np.concatenate(
+                [snapshot.document_ranges.get(name, np.empty((0, 2), dtype='int64')) for name in documents]
+                + [np.stack([shared, shared + 1], axis=1)]
+            )
+            ranges = ranges[np.argsort(ranges[:, 0])]
+        return snapshot.lexical.search(query, top_k, ranges)
+
+    @staticmethod
+    def _normalize_name(name: str) -> str:
+        name = re.sub(r'\s+', ' ', name.casefold()).strip()
+        return name[:-4] if name.endswith('.pdf') else name
+
+    def resolve_documents(self, documents: List[str], snapshot: IndexSnapshot = None) -> List[str]:
+        snapshot = snapshot or self._snapshot
+        filenames = snapshot.documents
+        resolved = []
+
+        for requested in documents:
+            if requested in filenames:
+                matches = [requested]
+            else:
+                wanted = self._normalize_name(requested)
+                matches = [name for name in filenames if wanted and wanted in self._normalize_name(name)]
+            resolved.extend(name for name in matches if name not in resolved)
+
+        return resolved
+
+    @staticmethod
+    def _normalize_scores(scores: np.ndarray, higher_is_better: bool = True) -> np.ndarray:
+        if not len(scores):
+            return scores
+        low, high = scores.min(), scores.max()
+        if high == low:
+            return np.ones_like(scores)
+        normalized = (scores - low) / (high - low)
+        return normalized if higher_is_better else 1 - normalized
+
+    def _hybrid_search(self, snapshot: IndexSnapshot, query: str, query_vector: np.ndarray, top_k: int,
+                       documents: List[str] = None) -> List[Tuple[int, float]]:
+        candidates = top_k * max(1, config.HYBRID_CANDIDATES)
+        vector_ids, distances = self._vector_search(snapshot, query_vector, candidates, documents)
+        lexical_ids, lexical_scores = self._lexical_search(snapshot, query, candidates, documents)
+
+        weight = config.HYBRID_LEXICAL_WEIGHT
+        fused = {}
+        for chunk_id, score in zip(vector_ids.tolist(), self._normalize_scores(distances, False).tolist()):
+            fused[chunk_id] = (1 - weight) * score
+        for chunk_id, score in zip(lexical_ids.tolist(), self._normalize_scores(lexical_scores).tolist()):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + weight * score
+
+        return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    # query_vector is the encode_query() result when the caller already has it, so a question is encoded once
+    def search(self, query: str, top_k: int = 5, mode: str = None, documents: List[str] = None,
+               query_vector: Optional[np.ndarray] = None) -> List[Dict]:
+        snapshot = self._snapshot
+        mode = mode or config.SEARCH_MODE
+
+        if snapshot.index.ntotal == 0:
             return []
 
-        query_embedding = self.model.encode([query], convert_to_numpy=True)
+        # Filtering picks the documents' shards and id ranges up front instead of post-filtering hits
+        if documents is not None:
+            documents = self.resolve_documents(documents, snapshot)
+            if not documents:
+                return []
+
+        if mode in ('hybrid', 'vector') and query_vector is None:
+            query_vector = self.encode_query(query)
+
+        if mode == 'hybrid':
+            hits = self._hybrid_search(snapshot, query, query_vector, top_k, documents)
+        elif mode == 'lexical':
+            hits = zip(*(a.tolist() for a in self._lexical_search(snapshot, query, top_k, documents)))
+        elif mode == 'vector':
+            hits = zip(*(a.tolist() for a in self._vector_search(snapshot, query_vector, top_k, documents)))
+        else:
+            raise ValueError(f"Unknown search mode '{mode}', expected vector, lexical or hybrid")
 
-        distances, indices = self.index.search(query_embedding.astype('float32'), min(top_k, self.index.ntotal))
-        
         results = []
-        for dist, idx in zip(distances[0], indices[0]):
-            if idx < len(self.chunks):
+        for chunk_id, score in hits:
+            chunk = snapshot.store.get(int(chunk_id))
+            if chunk:
+                text, metadata = chunk
+                shared = snapshot.aliases.get(int(chunk_id))
+                if shared:
+                    sources = [metadata, *shared]
+                    if documents is not None:
+                        # Cite the copy in a document the caller asked for
+                        metadata = next(source for source in sources if source['filename'] in documents)
+                    metadata = dict(metadata, sources=sources)
                 results.append({
-                    'text': self.chunks[idx],
-                    'metadata': self.chunk_metadata[idx],
-                    'score': float(dist)
+                    'chunk_id': int(chunk_id),
+                    'text': text,
+                    'metadata': metadata,
+                    'score': float(score)
                 })
-        
+
         return results
-    
-    def get_context(self, query: str, top_k: int = 5, max_length: int = 4000) -> str:
-        results = self.search(query, top_k)
-        
-        if not results:
-            return ""
-        
-        context_parts = []
-        current_length = 0
-        
-        for result in results:
-            text = result['text']
-            metadata = result['metadata']
-
-            chunk_text = f"[Документ: {metadata['filename']}]\n{text}\n"
-            chunk_length = len(chunk_text)
-            
-            if current_length + chunk_length > max_length:
-                break
-            
-            context_parts.append(chunk_text)
-            current_length += chunk_length
-        
-        return "\n---\n".join(context_parts)
-    
-    def save_index(self):
-        try:
-            faiss.write_index(self.index, self.index_path)
-            with open(self.chunks_path, 'wb') as f:
-                pickle.dump(self.chunks, f)
-            with open(self.metadata_path, 'wb') as f:
-                pickle.dump(self.chunk_metadata, f)
-            print("Index saved successfully")
-        except Exception as e:
-            print(f"Error saving index: {e}")
+
+    @staticmethod
+    def _add_similarities(query_vector: np.ndarray, results: List[Dict], snapshot: IndexSnapshot):
+        vectors = snapshot.store.vectors(np.array([r['chunk_id'] for r in results], dtype='int64'))
+        if vectors is None:
+            return
+
+        query_vector = query_vector[0]
+        norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query_vector)
+        similarities = vectors @ query_vector / np.where(norms > 0, norms, 1)
+        for result, similarity in zip(results, similarities.tolist()):
+            result['similarity'] = similarity
+
+    def pack_context(self, query: str, top_k: int = 5, documents: List[str] = None,
+                     query_vector: Optional[np.ndarray] = None) -> Tuple[str, Dict]:
+        snapshot = self._snapshot
+        # Relevance gating needs the vector even in lexical mode
+        if query_vector is None:
+            query_vector = self.encode_query(query)
+        results = self.search(query, top_k, documents=documents, query_vector=query_vector)
+        if results:
+            self._add_similarities(query_vector, results, snapshot)
+
+        context, report = self.context_packer.pack(results)
+
+        with self._context_stats_lock:
+            self.context_stats['requests'] += 1
+            self.context_stats['tokens'] += report['tokens']
+            self.context_stats['tokens_saved'] += report['tokens_saved']
+            self.context_stats['dropped_low_relevance'] += report['dropped_low_relevance']
+
+        return context, report
+
+    def get_context(self, query: str, top_k: int = 5, documents: List[str] = None) -> str:
+        return self.pack_context(query, top_k, documents)[0]
+
+    def _persist(self, snapshot: IndexSnapshot) -> bool:
+        with self._save_lock:
+            start = time.perf_counter()
+            try:
+                index, store, manifest = self.snapshots.write(
+                    snapshot.index, snapshot.store, snapshot.lexical, snapshot.aliases, snapshot.next_id
+                )
+            except Exception as e:
+                self.last_save = {'version': snapshot.version, 'error': str(e)}
+                print(f"Error saving index: {e}")
+                return False
+
+            # Swap in the mapped chunks and shard file names unless a writer got in first
+            with self._write_lock:
+                if self._snapshot is snapshot:
+                    self._snapshot = IndexSnapshot(index, store, snapshot.lexical, snapshot.next_id, snapshot.version,
+                                                   snapshot.aliases, snapshot._chunk_keys)
+
+            self.last_save = {
+                'generation': manifest['generation'],
+                'version': snapshot.version,
+                'chunks': manifest['chunks'],
+                'seconds': round(time.perf_counter() - start, 3)
+            }
+            print(f"Index snapshot {manifest['generation']} saved in {self.last_save['seconds']}s")
+            return True
+
+    def _save_loop(self):
+        while True:
+            with self._save_condition:
+                while self._save_completed >= self._save_requested:
+                    self._save_condition.wait()
+                requested = self._save_requested
+
+            # Requests that piled up during the previous write are covered by one write of the latest snapshot
+            self._persist(self._snapshot)
+
+            with self._save_condition:
+                self._save_completed = requested
+                self._save_condition.notify_all()
+
+    def save_index(self, wait: bool = False):
+        with self._save_condition:
+            self._save_requested += 1
+            requested = self._save_requested
+            if self._save_thread is None:
+                self._save_thread = threading.Thread(target=self._save_loop, name='index-writer', daemon=True)
+                self._save_thread.start()
+            self._save_condition.notify_all()
+
+            if wait:
+                while self._save_completed < requested:
+                    self._save_condition.wait()
 
     def rebuild_index(self):
         from backend.models import Document
 
-        self._create_new_index()
+        with self._write_lock:
+            start = time.perf_counter()
+            records = []
 
-        documents = Document.select()
+            for doc in Document.select():
+                if doc.content:
+                    try:
+                        chunks = list(self._iter_chunks(doc.content, config.CHUNK_SIZE, config.CHUNK_OVERLAP,
+                                                        doc.pages_count))
+                    except Exception as e:
+                        print(f"Error chunking {doc.filename}: {e}")
+                        continue
+                    if not chunks:
+                        print(f"No chunks created for {doc.filename}")
+                        continue
+                    records.extend(self._chunk_records(len(records), chunks, doc.filename))
 
-        if not documents:
-            print("No documents to index")
-            return
+            keys = {}
+            _, records, duplicates = self._split_duplicates(records, keys)
 
-        for doc in documents:
-            if doc.content:
-                try:
-                    self.add_document(doc.content, doc.filename)
-                except Exception as e:
-                    print(f"Error indexing {doc.filename}: {e}")
+            store = ChunkStore()
+            if records:
+                vectors = self._encode_chunks([r[1] for r in records], parallel=True)
+                store = store.with_chunks(records, vectors)
+                index = ShardedIndex.from_chunks(self.dimension, store.document_chunks, lambda ids: vectors[ids])
+            else:
+                print("No documents to index")
+                index = ShardedIndex(self.dimension)
+
+            self._publish(
+                index,
+                store,
+                LexicalIndex.build((r[0], r[1]) for r in records),
+                len(records),
+                ChunkAliases().with_sources(duplicates),
+                keys
+            )
+
+            elapsed = time.perf_counter() - start
+            self.last_rebuild = {
+                'chunks': len(records),
+                'duplicate_chunks': sum(len(sources) for sources in duplicates.values()),
+                'seconds': round(elapsed, 2),
+                'chunks_per_sec': round(len(records) / elapsed, 1) if elapsed else 0,
+                'workers': self.corpus_encoder.workers
+            }
 
         self.save_index()
-        print(f"Rebuilt index with {self.index.ntotal} vectors")
-    
+        print(f"Rebuilt index with {self.index.ntotal} vectors in {len(self.index.shards)} shards")
+
     def get_stats(self) -> Dict:
+        snapshot = self._snapshot
         return {
-            'total_chunks': len(self.chunks),
-            'total_vectors': self.index.ntotal if self.index else 0,
+            'total_chunks': len(snapshot.store),
+            'total_vectors': snapshot.index.ntotal if snapshot.index else 0,
             'dimension': self.dimension,
-            'unique_documents': len(set(m['filename'] for m in self.chunk_metadata))
-        }
\ No newline at end of file
+            'encoder_backend': self.backend,
+            'index_type': snapshot.index.index_type(),
+            'configured_index_type': config.INDEX_TYPE,
+            'index_shards': snapshot.index.get_stats(),
+            'bytes_per_vector': snapshot.index.bytes_per_vector(),
+            'mb_per_million_chunks': round(snapshot.index.bytes_per_vector() * 1e6 / 1024 / 1024, 1),
+            'unique_documents': len(snapshot.documents),
+            'shared_chunks': len(snapshot.aliases),
+            'index_version': snapshot.version,
+            'snapshot_generation': self.snapshots.generation,
+            'last_save': self.last_save,
+            'save_pending': self._save_completed < self._save_requested,
+            'query_cache': self.query_cache.get_stats(),
+            'query_batching': self.query_batcher.get_stats() if self.query_batcher else None,
+            'last_rebuild': self.last_rebuild,
+            'embedding_cache': self.embedding_cache.get_stats(),
+            'search_mode': config.SEARCH_MODE,
+            'context_packing': dict(self.context_stats, token_budget=self.context_packer.token_budget),
+            'lexical_index': snapshot.lexical.get_stats()
+        }
+
+
+_embeddings_service = None
+_embeddings_service_lock = threading.Lock()
+
+
+def get_embeddings_service() -> EmbeddingsService:
+    global _embeddings_service
+    if _embeddings_service is None:
+        with _embeddings_service_lock:
+            if _embeddings_service is None:
+                _embeddings_service = EmbeddingsService()
+    return _embeddings_service
+
+
+_warmup_state = {'status': 'idle', 'error': None, 'seconds': None}
+_warmup_thread = None
+
+
+def _warm_up(rebuild_if_empty: bool):
+    start = time.perf_counter()
+    try:
+        embeddings = get_embeddings_service()
+        if rebuild_if_empty and embeddings.index.ntotal == 0:
+            embeddings.rebuild_index()
+        # Built here so the first upload after a restart does not build it under the write lock
+        embeddings.snapshot.chunk_keys
+        embeddings.model.encode(['warm-up'], convert_to_numpy=True)
+        _warmup_state.update(status='ready', seconds=round(time.perf_counter() - start, 2))
+        print(f"Embeddings service ready in {_warmup_state['seconds']}s")
+    except Exception as e:
+        _warmup_state.update(status='error', error=str(e))
+        print(f"Embeddings warm-up failed: {e}")
+
+
+def start_warmup(rebuild_if_empty: bool = True) -> threading.Thread:
+    global _warmup_thread
+    with _embeddings_service_lock:
+        if _warmup_thread is None:
+            _warmup_state['status'] = 'loading'
+            _warmup_thread = threading.Thread(target=_warm_up, args=(rebuild_if_empty,), daemon=True)
+            _warmup_thread.start()
+    return _warmup_thread
+
+
+def get_readiness() -> Dict:
+    state = dict(_warmup_state)
+    if state['status'] == 'idle' and _embeddings_service is not None:
+        state['status'] = 'ready'
+    return state
+
+
+def wait_for_warmup():
+    thread = _warmup_thread
+    if thread is not None:
+        thread.join()
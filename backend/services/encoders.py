@@ -0,0 +1,47 @@
+import os
+from typing import Tuple
+import config
+
+ENCODER_BACKENDS = ('torch', 'onnx', 'onnx_int8')
+
+
+def _export_quantized(model_name: str) -> Tuple[str, str]:
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    export_dir = os.path.join(config.EMBEDDINGS_DIR, 'onnx', model_name.replace('/', '__'))
+    # The suffix is given explicitly: by default the library names the file after the weight dtype
+    file_suffix = f"quantized_{config.EMBEDDINGS_ONNX_QUANTIZATION}"
+    file_name = f"model_{file_suffix}.onnx"
+
+    if not os.path.exists(os.path.join(export_dir, 'onnx', file_name)):
+        print(f"Exporting {model_name} to dynamically quantized ONNX ({config.EMBEDDINGS_ONNX_QUANTIZATION})...")
+        model = SentenceTransformer(model_name, backend='onnx')
+        model.save(export_dir)
+        export_dynamic_quantized_onnx_model(model, config.EMBEDDINGS_ONNX_QUANTIZATION, export_dir,
+                                            file_suffix=file_suffix)
+
+    return export_dir, f"onnx/{file_name}"
+
+
+def load_model(model_name: str, backend: str = None) -> Tuple[object, str]:
+    from sentence_transformers import SentenceTransformer
+
+    backend = backend or config.EMBEDDINGS_BACKEND
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown embeddings backend '{backend}', expected one of {', '.join(ENCODER_BACKENDS)}")
+
+    if backend == 'torch':
+        return SentenceTransformer(model_name), backend
+
+    try:
+        if backend == 'onnx':
+            return SentenceTransformer(model_name, backend='onnx'), backend
+
+        export_dir, file_name = _export_quantized(model_name)
+        return SentenceTransformer(export_dir, backend='onnx', model_kwargs={'file_name': file_name}), backend
+    except ImportError as e:
+        print(f"ONNX backend unavailable ({e}), install sentence-transformers[onnx]; using torch")
+        return SentenceTransformer(model_name), 'torch'
+    except Exception as e:
+        print(f"Could not load the {backend} model ({e}), using torch")
+        return SentenceTransformer(model_name), 'torch'
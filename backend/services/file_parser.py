@@ -1,25 +1,266 @@
 import fitz  # PyMuPDF
 import pdfplumber
-from typing import Optional, Dict
+import atexit
+import hashlib
+import multiprocessing
+import re
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 import os
+import config
+from .parse_cache import get_parse_cache
+
+# Pages are kept apart by form feeds in Document.content so chunks can be traced back to their pages
+PAGE_BREAK = '\f'
+# Bump when the text produced for a page changes (e.g. different get_text options) to invalidate the parse cache
+EXTRACTION_VERSION = 1
+PARSE_METHODS = ('pymupdf', 'pdfplumber')
+
+# Replacement characters, control codes, private-use glyphs and pdfplumber's (cid:N) for unmapped fonts
+_GARBLED_RE = re.compile(r'[\ufffd\x00-\x08\x0b\x0e-\x1f\ue000-\uf8ff]|\(cid:\d+\)')
+# Pages with fewer readable characters count as empty (scans, pictures)
+_MIN_PAGE_CHARS = 20
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _parse_pool():
+    # Spawned workers are kept for the life of the process so only the first large document pays their start-up;
+    # ingestion threads share the pool
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = multiprocessing.get_context('spawn').Pool(config.PARSE_WORKERS)
+            atexit.register(_pool.terminate)
+        return _pool
+
+
+def _parallel(pages_count: int) -> bool:
+    return (config.PARSE_WORKERS > 1 and (os.cpu_count() or 1) > 1
+            and pages_count >= config.PARSE_PARALLEL_MIN_PAGES)
+
+
+def _iter_indices(method: str, file_path: str, indices: Iterable[int]) -> Iterator[str]:
+    if method == 'pdfplumber':
+        with pdfplumber.open(file_path) as pdf:
+            for i in indices:
+                yield pdf.pages[i].extract_text() or ''
+        return
+
+    doc = fitz.open(file_path)
+    try:
+        for i in indices:
+            yield doc[i].get_text()
+    finally:
+        doc.close()
+
+
+def _iter_range(method: str, file_path: str, start: int, end: int) -> Iterator[str]:
+    return _iter_indices(method, file_path, range(start, end))
+
+
+def _extract_range(args: Tuple[str, str, int, int]) -> List[str]:
+    return list(_iter_range(*args))
+
+
+def _page_count(method: str, file_path: str) -> int:
+    if method == 'pdfplumber':
+        with pdfplumber.open(file_path) as pdf:
+            return len(pdf.pages)
+    with fitz.open(file_path) as doc:
+        return len(doc)
+
+
+def _measure(method: str, file_path: str, indices: List[int]) -> Dict:
+    start = time.perf_counter()
+    texts = list(_iter_indices(method, file_path, indices))
+    elapsed = time.perf_counter() - start
+
+    readable = garbled = empty = 0
+    for text in texts:
+        page_readable = sum(1 for c in text if c.isalnum())
+        readable += page_readable
+        garbled += len(_GARBLED_RE.findall(text))
+        empty += page_readable < _MIN_PAGE_CHARS
+
+    garbled_share = garbled / (readable + garbled) if readable + garbled else 0
+    return {
+        'ms_per_page': round(elapsed * 1000 / len(indices), 2),
+        'chars_per_page': round(readable / len(indices), 1),
+        'garbled': round(garbled_share, 4),
+        'empty_pages': empty,
+        # Readable characters per page, discounted by how much of the output is garbage
+        'score': round(readable / len(indices) * (1 - garbled_share), 1)
+    }
+
+
+def _text_ok(result: Dict, sampled: int) -> bool:
+    return ('error' not in result and result['garbled'] <= config.PARSE_MAX_GARBLED
+            and result['empty_pages'] <= sampled * config.PARSE_MAX_EMPTY_SHARE)
+
+
+def parser_versions() -> Dict[str, str]:
+    versions = {
+        'pymupdf': f"{fitz.VersionBind}-{EXTRACTION_VERSION}",
+        'pdfplumber': f"{pdfplumber.__version__}-{EXTRACTION_VERSION}"
+    }
+    # Parser choices compare both backends, so they expire with either of them
+    versions['evaluation'] = f"{versions['pymupdf']}_{versions['pdfplumber']}"
+    return versions
+
 
 class FileParser:
     @staticmethod
-    def parse_pdf_pymupdf(file_path: str) -> Dict[str, any]:
+    def file_hash(file_path: str) -> str:
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def page_count(file_path: str, method: str = 'pymupdf') -> int:
+        return _page_count(method, file_path)
+
+    @staticmethod
+    def evaluate_parsers(file_path: str, sample_pages: Optional[int] = None, compare_all: bool = False) -> Dict:
+        # Times the backends on the same evenly spread pages and picks the fastest one whose text yield is
+        # within PARSE_MIN_YIELD_RATIO of the best. PyMuPDF goes first and the slower backends are only sampled
+        # when its text fails the checks: sampling pdfplumber alone can take longer than a full PyMuPDF parse.
+        sample_pages = sample_pages or config.PARSE_SAMPLE_PAGES
+        backends = {}
+        pages_count = None
+        for method in PARSE_METHODS:
+            try:
+                if pages_count is None:
+                    pages_count = _page_count(method, file_path)
+                    indices = sorted({i * pages_count // sample_pages for i in range(min(sample_pages, pages_count))})
+                backends[method] = _measure(method, file_path, indices) if pages_count else {'score': 0}
+            except Exception as e:
+                backends[method] = {'error': str(e)}
+            if not compare_all and (not pages_count or _text_ok(backends[method], len(indices))):
+                break
+
+        usable = {method: result for method, result in backends.items() if 'error' not in result}
+        if not usable:
+            raise ValueError('; '.join(f"{method}: {result['error']}" for method, result in backends.items()))
+
+        best = max(result['score'] for result in usable.values())
+        acceptable = [method for method, result in usable.items()
+                      if result['score'] >= best * config.PARSE_MIN_YIELD_RATIO]
+        method = min(acceptable, key=lambda name: usable[name].get('ms_per_page', 0))
+
+        return {
+            'method': method,
+            'pages_count': pages_count,
+            'sampled_pages': len(indices) if pages_count else 0,
+            'no_text': best == 0,
+            'backends': backends
+        }
+
+    @staticmethod
+    def choose_method(file_path: str, content_hash: Optional[str] = None) -> Dict:
+        cache = get_parse_cache()
+        if cache is not None:
+            content_hash = content_hash or FileParser.file_hash(file_path)
+            evaluation = cache.get(content_hash, 'evaluation')
+            if evaluation is not None:
+                return evaluation
+
+        evaluation = FileParser.evaluate_parsers(file_path)
+        summary = ', '.join(
+            f"{name} {result['ms_per_page']} ms/page {result['chars_per_page']} chars/page"
+            for name, result in evaluation['backends'].items() if 'ms_per_page' in result
+        )
+        print(f"Chose {evaluation['method']} for {os.path.basename(file_path)} ({summary})"
+              + (' - no text layer on sampled pages' if evaluation['no_text'] else ''))
+
+        if cache is not None:
+            cache.put(content_hash, 'evaluation', evaluation)
+        return evaluation
+
+    @staticmethod
+    def resolve_method(file_path: str, method: str = 'auto',
+                       content_hash: Optional[str] = None) -> Tuple[str, Optional[Dict]]:
+        if method != 'auto':
+            return method, None
         try:
-            doc = fitz.open(file_path)
-            text = ""
-            pages_count = len(doc)
-            
-            for page_num in range(pages_count):
-                page = doc[page_num]
-                text += page.get_text()
-            
-            doc.close()
-            
+            evaluation = FileParser.choose_method(file_path, content_hash)
+            return evaluation['method'], evaluation
+        except Exception as e:
+            print(f"Could not compare parsers on {os.path.basename(file_path)}: {e}")
+            return PARSE_METHODS[0], None
+
+    @staticmethod
+    def iter_pages(file_path: str, method: str = 'pymupdf', content_hash: Optional[str] = None) -> Iterator[str]:
+        cache = get_parse_cache()
+        if cache is None:
+            yield from FileParser._extract_pages(file_path, method)
+            return
+
+        content_hash = content_hash or FileParser.file_hash(file_path)
+        pages = cache.get(content_hash, method)
+        if pages is not None:
+            print(f"Read {len(pages)} pages of {os.path.basename(file_path)} from the parse cache")
+            yield from pages
+            return
+
+        # Only a complete extraction is cached; a consumer that stops early leaves no entry
+        pages = []
+        for page in FileParser._extract_pages(file_path, method):
+            pages.append(page)
+            yield page
+        cache.put(content_hash, method, pages)
+
+    @staticmethod
+    def _extract_pages(file_path: str, method: str) -> Iterator[str]:
+        pages_count = _page_count(method, file_path)
+        workers = 1
+        start = time.perf_counter()
+
+        if not _parallel(pages_count):
+            yield from _iter_range(method, file_path, 0, pages_count)
+        else:
+            # A few ranges per worker keep the pool busy when some pages are much heavier than others
+            workers = config.PARSE_WORKERS
+            step = max(1, -(-pages_count // (workers * 4)))
+            ranges = [(method, file_path, i, min(i + step, pages_count)) for i in range(0, pages_count, step)]
+            for texts in _parse_pool().imap(_extract_range, ranges):
+                yield from texts
+
+        elapsed = time.perf_counter() - start
+        print(f"Parsed {pages_count} pages of {os.path.basename(file_path)} with {method} in {elapsed:.2f}s "
+              f"({pages_count / elapsed if elapsed else 0:.0f} pages/sec, {workers} workers)")
+
+    @staticmethod
+    def extract_pages(file_path: str, method: str = 'pymupdf', content_hash: Optional[str] = None) -> List[str]:
+        return list(FileParser.iter_pages(file_path, method, content_hash))
+
+    @staticmethod
+    def join_pages(pages: Iterable[str]) -> str:
+        return PAGE_BREAK.join(page.strip() for page in pages)
+
+    @staticmethod
+    def split_pages(text: str) -> Iterator[str]:
+        start = 0
+        while True:
+            end = text.find(PAGE_BREAK, start)
+            if end == -1:
+                yield text[start:]
+                return
+            yield text[start:end]
+            start = end + 1
+
+    @staticmethod
+    def parse_pdf_pymupdf(file_path: str, content_hash: Optional[str] = None) -> Dict[str, any]:
+        try:
+            pages = FileParser.extract_pages(file_path, 'pymupdf', content_hash)
+
             return {
-                'content': text.strip(),
-                'pages_count': pages_count,
+                'content': FileParser.join_pages(pages),
+                'pages_count': len(pages),
                 'success': True,
                 'error': None
             }
@@ -32,21 +273,13 @@ class FileParser:
             }
     
     @staticmethod
-    def parse_pdf_pdfplumber(file_path: str) -> Dict[str, any]:
+    def parse_pdf_pdfplumber(file_path: str, content_hash: Optional[str] = None) -> Dict[str, any]:
         try:
-            text = ""
-            pages_count = 0
-            
-            with pdfplumber.open(file_path) as pdf:
-                pages_count = len(pdf.pages)
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n"
-            
+            pages = FileParser.extract_pages(file_path, 'pdfplumber', content_hash)
+
             return {
-                'content': text.strip(),
-                'pages_count': pages_count,
+                'content': FileParser.join_pages(pages),
+                'pages_count': len(pages),
                 'success': True,
                 'error': None
             }
@@ -59,7 +292,7 @@ class FileParser:
             }
     
     @staticmethod
-    def parse_pdf(file_path: str, method: str = 'pymupdf') -> Dict[str, any]:
+    def parse_pdf(file_path: str, method: Optional[str] = None, content_hash: Optional[str] = None) -> Dict[str, any]:
         if not os.path.exists(file_path):
             return {
                 'content': '',
@@ -67,44 +300,87 @@ class FileParser:
                 'success': False,
                 'error': 'File not found'
             }
-        
+
+        method, evaluation = FileParser.resolve_method(file_path, method or config.PARSE_METHOD, content_hash)
+
         if method == 'pdfplumber':
-            result = FileParser.parse_pdf_pdfplumber(file_path)
+            result = FileParser.parse_pdf_pdfplumber(file_path, content_hash)
         else:
-            result = FileParser.parse_pdf_pymupdf(file_path)
+            result = FileParser.parse_pdf_pymupdf(file_path, content_hash)
 
         if not result['success'] and method == 'pymupdf':
             print(f"PyMuPDF failed, trying pdfplumber...")
-            result = FileParser.parse_pdf_pdfplumber(file_path)
+            result = FileParser.parse_pdf_pdfplumber(file_path, content_hash)
+            method = 'pdfplumber'
         elif not result['success'] and method == 'pdfplumber':
             print(f"pdfplumber failed, trying PyMuPDF...")
-            result = FileParser.parse_pdf_pymupdf(file_path)
-        
+            result = FileParser.parse_pdf_pymupdf(file_path, content_hash)
+            method = 'pymupdf'
+
+        result['method'] = method
+        result['evaluation'] = evaluation
         return result
     
+    @staticmethod
+    def iter_chunks(pages: Iterable[str], chunk_size: int = 1000,
+                    overlap: int = 200) -> Iterator[Tuple[str, int, int]]:
+        # Yields (chunk, first page, last page) while holding only about one chunk and one page of text
+        pages = iter(pages)
+        buffer = ''
+        page_starts = []
+        page_number = 0
+        exhausted = False
+
+        def page_at(offset: int) -> int:
+            page = page_starts[0][1]
+            for start, number in page_starts:
+                if start > offset:
+                    break
+                page = number
+            return page
+
+        while True:
+            while not exhausted and len(buffer) <= chunk_size:
+                page = next(pages, None)
+                if page is None:
+                    exhausted = True
+                    break
+                page_number += 1
+                if page.strip():
+                    page_starts.append((len(buffer), page_number))
+                    buffer += page if page.endswith('\n') else page + '\n'
+
+            if not buffer:
+                return
+
+            end = min(chunk_size, len(buffer))
+            chunk = buffer[:end]
+            if end < len(buffer):
+                # Prefer a paragraph break, then the end of a sentence or line, so chunks keep whole clauses
+                break_point = chunk.rfind('\n\n')
+                if break_point <= chunk_size * 0.5:
+                    break_point = max(chunk.rfind('.'), chunk.rfind('\n'))
+                if break_point > chunk_size * 0.5:
+                    end = break_point + 1
+                    chunk = chunk[:end]
+
+            text = chunk.strip()
+            if text:
+                first = len(chunk) - len(chunk.lstrip())
+                last = len(chunk.rstrip()) - 1
+                yield text, page_at(first), page_at(last)
+
+            if exhausted and end >= len(buffer):
+                return
+
+            cut = end - overlap if end > overlap else end
+            current = page_at(cut)
+            buffer = buffer[cut:]
+            page_starts = [(max(0, start - cut), number) for start, number in page_starts
+                           if start >= cut or number == current]
+
     @staticmethod
     def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> list:
         if not text:
             return []
-        
-        chunks = []
-        start = 0
-        text_length = len(text)
-        
-        while start < text_length:
-            end = start + chunk_size
-            chunk = text[start:end]
-
-            if end < text_length:
-                last_period = chunk.rfind('.')
-                last_newline = chunk.rfind('\n')
-                break_point = max(last_period, last_newline)
-                
-                if break_point > chunk_size * 0.5:
-                    chunk = chunk[:break_point + 1]
-                    end = start + break_point + 1
-            
-            chunks.append(chunk.strip())
-            start = end - overlap
-        
-        return chunks
+        return [chunk for chunk, _, _ in FileParser.iter_chunks(FileParser.split_pages(text), chunk_size, overlap)]
@@ -2,6 +2,7 @@ import requests
 import uuid
 from typing import Optional, Dict
 import config
+from .answer_cache import SemanticAnswerCache
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -12,6 +13,8 @@ class GigaChatClient:
         self.base_url = "https://gigachat.devices.sberbank.ru/api/v1"
         self.access_token = None
         self.chat_id = str(uuid.uuid4())
+        self.answer_cache = SemanticAnswerCache(config.ANSWER_CACHE_SIZE, config.ANSWER_CACHE_THRESHOLD,
+                                                config.ANSWER_CACHE_MIN_OVERLAP)
     
     def _get_access_token(self) -> Optional[str]:
         try:
@@ -128,13 +131,27 @@ class GigaChatClient:
                 'response': None
             }
     
-    def ask_with_rag(self, question: str, embeddings_service) -> Dict:
-        context = embeddings_service.get_context(question, top_k=config.TOP_K_RESULTS)
+    def ask_with_rag(self, question: str, embeddings_service, documents: Optional[list] = None) -> Dict:
+        query_vector = embeddings_service.encode_query(question)
+        index_version = embeddings_service.version
+        scope = self.answer_cache.scope_of(documents)
+
+        cached = self.answer_cache.get(query_vector, question, index_version, scope)
+        if cached:
+            cached.update({'success': True, 'error': None, 'cached': True})
+            return cached
+
+        context, packing = embeddings_service.pack_context(question, top_k=config.TOP_K_RESULTS, documents=documents,
+                                                           query_vector=query_vector)
 
         result = self.ask(question, context)
         
         if result['success']:
             result['context_used'] = bool(context)
             result['context_length'] = len(context) if context else 0
+            result['context_tokens'] = packing['tokens']
+            result['context_tokens_saved'] = packing['tokens_saved']
+            result['cached'] = False
+            self.answer_cache.put(query_vector, question, index_version, result, scope)
         
         return result
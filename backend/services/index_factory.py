@@ -0,0 +1,131 @@
+import math
+import numpy as np
+import faiss
+from typing import Callable, Optional
+import config
+
+INDEX_TYPES = ('flat', 'ivf_flat', 'hnsw', 'ivf_pq', 'sq8', 'pq')
+
+# Index types that learn centroids or codebooks. A document's shard is far too small to train them on, so
+# every shard is cloned from one template trained on the whole corpus
+TRAINED_TYPES = ('ivf_flat', 'ivf_pq', 'pq')
+
+# Index types whose distances are computed on compressed codes and can be re-ranked exactly
+LOSSY_TYPES = ('ivf_pq', 'sq8', 'pq')
+
+PQ_BITS = 8
+MIN_PQ_BITS = 4
+
+
+def _nlist_for(count: int) -> int:
+    if config.INDEX_NLIST:
+        return config.INDEX_NLIST
+    # faiss wants ~39 training points per centroid; 4*sqrt(n) is the usual starting point
+    return max(1, min(int(4 * math.sqrt(count)), count // 39))
+
+
+def _pq_bits_for(count: int) -> int:
+    # Same ~39 points per codebook centroid; smaller corpora get fewer bits per sub-quantizer
+    return max(MIN_PQ_BITS, min(PQ_BITS, int(math.log2(max(1, count // 39)))))
+
+
+def _min_training_points(index_type: str, count: int) -> int:
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        return max(39 * _nlist_for(count), 39 * 2 ** MIN_PQ_BITS)
+    if index_type == 'pq':
+        return 39 * 2 ** MIN_PQ_BITS
+    if index_type == 'sq8':
+        return 1
+    return 0
+
+
+def can_train(index_type: str, count: int) -> bool:
+    return index_type in ('flat', 'hnsw') or (count > 0 and count >= _min_training_points(index_type, count))
+
+
+def _build_inner(dimension: int, index_type: str, count: int):
+    if index_type == 'ivf_flat':
+        quantizer = faiss.IndexFlatL2(dimension)
+        return faiss.IndexIVFFlat(quantizer, dimension, _nlist_for(count))
+    if index_type == 'ivf_pq':
+        quantizer = faiss.IndexFlatL2(dimension)
+        return faiss.IndexIVFPQ(quantizer, dimension, _nlist_for(count), config.INDEX_PQ_M, _pq_bits_for(count))
+    if index_type == 'sq8':
+        return faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit)
+    if index_type == 'pq':
+        return faiss.IndexPQ(dimension, config.INDEX_PQ_M, _pq_bits_for(count))
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dimension, config.INDEX_HNSW_M)
+        index.hnsw.efConstruction = config.INDEX_HNSW_EF_CONSTRUCTION
+        return index
+    return faiss.IndexFlatL2(dimension)
+
+
+def create_index(dimension: int, training_vectors: Optional[np.ndarray] = None, index_type: Optional[str] = None):
+    index_type = index_type or config.INDEX_TYPE
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {', '.join(INDEX_TYPES)}")
+
+    count = len(training_vectors) if training_vectors is not None else 0
+    if not can_train(index_type, count):
+        print(f"Not enough vectors to train {index_type} ({count}), using flat index until next rebuild")
+        index_type = 'flat'
+
+    inner = _build_inner(dimension, index_type, count)
+    if not inner.is_trained:
+        inner.train(training_vectors)
+
+    index = faiss.IndexIDMap2(inner)
+    configure_search(index)
+    return index
+
+
+def configure_search(index):
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = min(config.INDEX_NPROBE, inner.nlist)
+    elif isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = config.INDEX_HNSW_EF_SEARCH
+    return index
+
+
+def index_type_of(index) -> str:
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return 'ivf_pq'
+    if isinstance(inner, faiss.IndexIVFFlat):
+        return 'ivf_flat'
+    if isinstance(inner, faiss.IndexHNSW):
+        return 'hnsw'
+    if isinstance(inner, faiss.IndexScalarQuantizer):
+        return 'sq8'
+    if isinstance(inner, faiss.IndexPQ):
+        return 'pq'
+    return 'flat'
+
+
+def bytes_per_vector(index) -> int:
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    # Every vector also carries its 8-byte chunk id, in the id map or the inverted list
+    if isinstance(inner, faiss.IndexHNSW):
+        storage = faiss.downcast_index(inner.storage)
+        return storage.code_size + inner.hnsw.nb_neighbors(0) * 4 + 8
+    return inner.code_size + 8
+
+
+def search(index, query: np.ndarray, top_k: int, rerank: int = 0,
+           vectors_for: Optional[Callable[[np.ndarray], Optional[np.ndarray]]] = None):
+    if not rerank or vectors_for is None or index_type_of(index) not in LOSSY_TYPES:
+        return index.search(query, top_k)
+
+    _, shortlist = index.search(query, min(top_k * rerank, index.ntotal))
+    shortlist = shortlist[0][shortlist[0] >= 0]
+
+    exact = vectors_for(shortlist)
+    if exact is None:
+        return index.search(query, top_k)
+
+    distances = ((exact - query[0]) ** 2).sum(axis=1)
+    order = np.argsort(distances)[:top_k]
+    return distances[order][None, :], shortlist[order][None, :]
+
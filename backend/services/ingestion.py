@@ -0,0 +1,229 @@
+import io
+import json
+import os
+import threading
+import time
+import numpy as np
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+from peewee import fn
+from backend.models import Document, IngestionJob
+from .file_parser import FileParser, PAGE_BREAK, PARSE_METHODS
+import config
+
+
+class _ParseFailed(Exception):
+    pass
+
+
+def _update(job: IngestionJob, **fields):
+    for name, value in fields.items():
+        setattr(job, name, value)
+    IngestionJob.update(**fields).where(IngestionJob.id == job.id).execute()
+
+
+def _finish(job: IngestionJob, status: str, **fields):
+    _update(job, status=status, finished_at=datetime.now(), **fields)
+
+
+def enqueue_document(filename: str, file_path: str, content_hash: Optional[str] = None,
+                     source: str = 'upload') -> IngestionJob:
+    job = IngestionJob.create(filename=filename, file_path=file_path, content_hash=content_hash, source=source)
+    if _queue:
+        _queue.notify()
+    return job
+
+
+def pending_job(filename: Optional[str] = None, content_hash: Optional[str] = None) -> Optional[IngestionJob]:
+    query = IngestionJob.select().where(IngestionJob.status.in_(IngestionJob.PENDING))
+    if filename is not None:
+        query = query.where(IngestionJob.filename == filename)
+    if content_hash is not None:
+        query = query.where(IngestionJob.content_hash == content_hash)
+    return query.first()
+
+
+def get_job(job_id: int) -> Optional[IngestionJob]:
+    return IngestionJob.get_or_none(IngestionJob.id == job_id)
+
+
+# Jobs live in the ingestion_jobs table, so anything queued survives a restart and can be queued
+# from another process (init_db runs in main.py); workers also poll for jobs they were not told about.
+class IngestionQueue:
+    def __init__(self, workers: int, poll_seconds: float):
+        self.workers = max(1, workers)
+        self.poll_seconds = poll_seconds
+        self._wakeup = threading.Event()
+        self._claim_lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        # Jobs cut off by a restart run again from the start; publishing replaces any partial result
+        IngestionJob.update(status=IngestionJob.QUEUED, stage=None, progress=0).where(
+            IngestionJob.status == IngestionJob.RUNNING
+        ).execute()
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'ingest-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _claim(self) -> Optional[IngestionJob]:
+        with self._claim_lock:
+            queued = IngestionJob.select(IngestionJob.id).where(
+                IngestionJob.status == IngestionJob.QUEUED
+            ).order_by(IngestionJob.id).limit(8)
+
+            for job in queued:
+                # The status condition keeps a job from being taken twice, also by another process
+                claimed = IngestionJob.update(
+                    status=IngestionJob.RUNNING,
+                    started_at=datetime.now(),
+                    attempts=IngestionJob.attempts + 1,
+                    error=None
+                ).where((IngestionJob.id == job.id) & (IngestionJob.status == IngestionJob.QUEUED)).execute()
+                if claimed:
+                    return IngestionJob.get_by_id(job.id)
+        return None
+
+    def _work(self):
+        from .embeddings import wait_for_warmup
+
+        # Publishing while the warm-up rebuilds an empty index could lose the document
+        wait_for_warmup()
+
+        while True:
+            try:
+                job = self._claim()
+            except Exception as e:
+                print(f"Error claiming ingestion job: {e}")
+                job = None
+
+            if job is None:
+                self._wakeup.wait(self.poll_seconds)
+                self._wakeup.clear()
+                continue
+
+            self._run(job)
+
+    def _run(self, job: IngestionJob):
+        start = time.perf_counter()
+        try:
+            self._ingest(job)
+        except Exception as e:
+            print(f"Ingestion of {job.filename} failed during {job.stage}: {e}")
+            _finish(job, IngestionJob.FAILED, error=str(e))
+            if job.source == 'upload' and isinstance(e, _ParseFailed) and os.path.exists(job.file_path):
+                os.remove(job.file_path)
+            return
+
+        print(f"Ingestion of {job.filename} {job.status} in {time.perf_counter() - start:.1f}s")
+
+    def _stream_pages(self, job: IngestionJob, method: str, content: io.StringIO) -> Iterator[str]:
+        # Hands the chunker one page at a time, writing the Document.content text (as FileParser.join_pages
+        # would) and the progress along the way
+        try:
+            total = FileParser.page_count(job.file_path, method)
+            _update(job, progress=0, pages_count=total)
+            step = max(1, total // 20)
+            for done, page in enumerate(FileParser.iter_pages(job.file_path, method, job.content_hash), 1):
+                page = page.strip()
+                if done > 1:
+                    content.write(PAGE_BREAK)
+                content.write(page)
+                if done % step == 0:
+                    _update(job, progress=done / total)
+                yield page
+        except Exception as e:
+            raise _ParseFailed(f"{method}: {e}") from e
+
+    def _process(self, job: IngestionJob, embeddings) -> Tuple[List[Tuple], np.ndarray, str, str, Optional[Dict]]:
+        # Parsing, chunking and embedding run as one pipeline, so the pages and the chunks waiting for the
+        # encoder are never all in memory. A backend failing part-way is retried from scratch with the other
+        # one, as in FileParser.parse_pdf.
+        method, evaluation = FileParser.resolve_method(job.file_path, config.PARSE_METHOD, job.content_hash)
+        error = None
+        for method in [method] + [other for other in PARSE_METHODS if other != method]:
+            content = io.StringIO()
+            try:
+                chunks, vectors = embeddings.encode_pages(
+                    self._stream_pages(job, method, content),
+                    lambda done: _update(job, chunks_count=done)
+                )
+                return chunks, vectors, content.getvalue(), method, evaluation
+            except _ParseFailed as e:
+                print(f"Could not parse {job.filename} with {e}")
+                error = e
+        raise _ParseFailed(f"Failed to parse PDF: {error}")
+
+    def _ingest(self, job: IngestionJob):
+        from .embeddings import get_embeddings_service
+        from .db_service import DatabaseService
+
+        if not os.path.exists(job.file_path):
+            raise FileNotFoundError('File not found')
+
+        content_hash = job.content_hash or FileParser.file_hash(job.file_path)
+        duplicate = Document.get_or_none((Document.content_hash == content_hash) & (Document.filename != job.filename))
+        if duplicate:
+            _finish(job, IngestionJob.SKIPPED, content_hash=content_hash,
+                    error=f"Identical to existing document '{duplicate.filename}'")
+            return
+
+        _update(job, stage='process', progress=0, content_hash=content_hash)
+        embeddings = get_embeddings_service()
+        chunks, vectors, content, parse_method, evaluation = self._process(job, embeddings)
+        parse_stats = json.dumps(evaluation, ensure_ascii=False) if evaluation else None
+
+        _update(job, stage='publish', progress=0, chunks_count=len(chunks))
+        if not chunks:
+            print(f"No text extracted from {job.filename}")
+        if job.filename in embeddings.snapshot.documents:
+            embeddings.replace_document(job.filename, chunks, vectors)
+        elif chunks:
+            embeddings.publish_document(job.filename, chunks, vectors)
+
+        doc = DatabaseService.get_document(job.filename)
+        if doc:
+            doc.content = content
+            doc.file_path = job.file_path
+            doc.pages_count = job.pages_count
+            doc.content_hash = content_hash
+            doc.parse_method = parse_method
+            doc.parse_stats = parse_stats
+            doc.save()
+        else:
+            DatabaseService.add_document(job.filename, content, job.file_path, job.pages_count, content_hash,
+                                         parse_method, parse_stats)
+
+        embeddings.save_index()
+        _finish(job, IngestionJob.DONE, progress=1)
+
+    def get_stats(self) -> Dict:
+        counts = IngestionJob.select(IngestionJob.status, fn.COUNT(IngestionJob.id).alias('count')).group_by(
+            IngestionJob.status
+        )
+        return {
+            'workers': self.workers,
+            'jobs': {row.status: row.count for row in counts}
+        }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def start_ingestion() -> IngestionQueue:
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = IngestionQueue(config.INGEST_WORKERS, config.INGEST_POLL_SECONDS)
+            _queue.start()
+    return _queue
+
+
+def get_ingestion_queue() -> Optional[IngestionQueue]:
+    return _queue
@@ -0,0 +1,267 @@
+import json
+import math
+import os
+import re
+import numpy as np
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Dotted or hyphenated numbers (clause 5.2.1, date 15.12.2020, 12-34) stay one token
+TOKEN_RE = re.compile(r'\d+(?:[.\-]\d+)+|[0-9a-zа-яё]+')
+
+# Bumped whenever tokenize() changes; saved indexes of another version are rebuilt
+TOKENIZER_VERSION = 2
+
+STOP_WORDS = frozenset((
+    'и', 'в', 'во', 'не', 'что', 'он', 'на', 'я', 'с', 'со', 'как', 'а', 'то', 'все', 'она', 'так', 'его',
+    'но', 'да', 'ты', 'к', 'у', 'же', 'вы', 'за', 'бы', 'по', 'только', 'ее', 'мне', 'было', 'вот', 'от',
+    'меня', 'о', 'из', 'ему', 'для', 'при', 'или', 'их', 'это', 'этом', 'том', 'также', 'быть', 'был',
+    'который', 'которые', 'если', 'до', 'под', 'над', 'об', 'либо', 'ли'
+))
+
+_VOWELS = 'аеиоуыэюя'
+_RV = re.compile(r'^(.*?[аеиоуыэюя])(.*)$')
+_PERFECTIVE_GERUND = re.compile(r'((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$')
+_REFLEXIVE = re.compile(r'(с[яь])$')
+_ADJECTIVE = re.compile(r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$')
+_PARTICIPLE = re.compile(r'((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$')
+_VERB = re.compile(r'((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|'
+                   r'ыть|ишь|ую|ю)|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$')
+_NOUN = re.compile(r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|'
+                   r'ью|ю|ия|ья|я)$')
+_DERIVATIONAL = re.compile(r'.*[^аеиоуыэюя]+[аеиоуыэюя]+[^аеиоуыэюя]+[аеиоуыэюя].*ость?$')
+
+try:
+    import snowballstemmer
+    _snowball = snowballstemmer.stemmer('russian')
+except ImportError:
+    _snowball = None
+
+
+@lru_cache(maxsize=200000)
+def stem(word: str) -> str:
+    if not any(c in _VOWELS for c in word) or word[0].isdigit():
+        return word
+    if _snowball:
+        return _snowball.stemWord(word)
+
+    match = _RV.match(word)
+    if not match:
+        return word
+    prefix, rv = match.groups()
+
+    stripped = _PERFECTIVE_GERUND.sub('', rv, 1)
+    if stripped == rv:
+        rv = _REFLEXIVE.sub('', rv, 1)
+        stripped = _ADJECTIVE.sub('', rv, 1)
+        if stripped != rv:
+            rv = _PARTICIPLE.sub('', stripped, 1)
+        else:
+            stripped = _VERB.sub('', rv, 1)
+            rv = _NOUN.sub('', rv, 1) if stripped == rv else stripped
+    else:
+        rv = stripped
+
+    rv = re.sub(r'и$', '', rv)
+    if _DERIVATIONAL.match(rv):
+        rv = re.sub(r'ость?$', '', rv)
+
+    stripped = re.sub(r'ь$', '', rv)
+    if stripped == rv:
+        rv = re.sub(r'нн$', 'н', re.sub(r'(ейше|ейш)$', '', rv))
+    else:
+        rv = stripped
+
+    return prefix + rv
+
+
+def tokenize(text: str) -> List[str]:
+    return [
+        stem(token) for token in TOKEN_RE.findall(text.lower().replace('ё', 'е'))
+        if token not in STOP_WORDS and (len(token) > 1 or token.isdigit())
+    ]
+
+
+# BM25 over chunk texts. Each term maps to a sorted int64 array of chunk ids and a parallel uint16 array
+# of term frequencies; updates build new arrays for the touched terms so snapshots share everything else.
+class LexicalIndex:
+    FILE = 'lexical_index.npz'
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, postings: Optional[Dict[str, Tuple[np.ndarray, np.ndarray]]] = None,
+                 lengths: Optional[np.ndarray] = None, count: int = 0, total_length: int = 0,
+                 version: int = TOKENIZER_VERSION):
+        self.postings = postings or {}
+        self.lengths = lengths if lengths is not None else np.zeros(0, dtype='int32')
+        self.count = count
+        self.total_length = total_length
+        self.version = version
+
+    @classmethod
+    def build(cls, chunks: Iterable[Tuple[int, str]]) -> 'LexicalIndex':
+        return cls().with_chunks(chunks)
+
+    @staticmethod
+    def _term_counts(text: str) -> Dict[str, int]:
+        counts = {}
+        for term in tokenize(text):
+            counts[term] = counts.get(term, 0) + 1
+        return counts
+
+    def with_chunks(self, chunks: Iterable[Tuple[int, str]]) -> 'LexicalIndex':
+        added = {}
+        lengths = []
+        for chunk_id, text in chunks:
+            counts = self._term_counts(text)
+            for term, tf in counts.items():
+                added.setdefault(term, ([], []))
+                added[term][0].append(chunk_id)
+                added[term][1].append(min(tf, 65535))
+            lengths.append((chunk_id, sum(counts.values())))
+
+        if not lengths:
+            return self
+
+        postings = dict(self.postings)
+        for term, (ids, tfs) in added.items():
+            ids = np.array(ids, dtype='int64')
+            tfs = np.array(tfs, dtype='uint16')
+            if term in postings:
+                old_ids, old_tfs = postings[term]
+                ids = np.concatenate([old_ids, ids])
+                tfs = np.concatenate([old_tfs, tfs])
+                order = np.argsort(ids, kind='stable')
+                ids, tfs = ids[order], tfs[order]
+            postings[term] = (ids, tfs)
+
+        size = max(len(self.lengths), max(chunk_id for chunk_id, _ in lengths) + 1)
+        doc_lengths = np.zeros(size, dtype='int32')
+        doc_lengths[:len(self.lengths)] = self.lengths
+        for chunk_id, length in lengths:
+            doc_lengths[chunk_id] = length
+
+        return LexicalIndex(postings, doc_lengths, self.count + len(lengths),
+                            self.total_length + sum(length for _, length in lengths))
+
+    def without(self, chunks: Iterable[Tuple[int, str]]) -> 'LexicalIndex':
+        removed = {}
+        ids = []
+        for chunk_id, text in chunks:
+            ids.append(chunk_id)
+            for term in self._term_counts(text):
+                removed.setdefault(term, []).append(chunk_id)
+
+        if not ids:
+            return self
+
+        postings = dict(self.postings)
+        for term, term_ids in removed.items():
+            if term not in postings:
+                continue
+            old_ids, old_tfs = postings[term]
+            keep = ~np.isin(old_ids, term_ids)
+            if keep.any():
+                postings[term] = (old_ids[keep], old_tfs[keep])
+            else:
+                del postings[term]
+
+        doc_lengths = self.lengths.copy()
+        ids = np.array(ids, dtype='int64')
+        ids = ids[ids < len(doc_lengths)]
+        total_length = self.total_length - int(doc_lengths[ids].sum())
+        doc_lengths[ids] = 0
+
+        return LexicalIndex(postings, doc_lengths, max(0, self.count - len(ids)), total_length)
+
+    @staticmethod
+    def _slice_ranges(ids: np.ndarray, tfs: np.ndarray, ranges: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        starts = np.searchsorted(ids, ranges[:, 0])
+        ends = np.searchsorted(ids, ranges[:, 1])
+        if len(ranges) == 1:
+            return ids[starts[0]:ends[0]], tfs[starts[0]:ends[0]]
+        return (np.concatenate([ids[start:end] for start, end in zip(starts, ends)]),
+                np.concatenate([tfs[start:end] for start, end in zip(starts, ends)]))
+
+    # ranges is an (n, 2) array of [start, end) chunk id ranges; postings are sorted, so only the
+    # slice inside each range is scored
+    def search(self, query: str, top_k: int, ranges: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        empty = np.empty(0, dtype='int64'), np.empty(0, dtype='float32')
+        if not self.count:
+            return empty
+
+        avg_length = self.total_length / self.count or 1.0
+        all_ids = []
+        all_scores = []
+
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            ids, tfs = posting
+            idf = math.log(1 + (self.count - len(ids) + 0.5) / (len(ids) + 0.5))
+            if ranges is not None:
+                ids, tfs = self._slice_ranges(ids, tfs, ranges)
+                if not len(ids):
+                    continue
+            tfs = tfs.astype('float32')
+            norm = self.K1 * (1 - self.B + self.B * self.lengths[ids] / avg_length)
+            all_ids.append(ids)
+            all_scores.append(idf * tfs * (self.K1 + 1) / (tfs + norm))
+
+        if not all_ids:
+            return empty
+
+        ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores)).astype('float32')
+
+        if len(ids) > top_k:
+            top = np.argpartition(-scores, top_k)[:top_k]
+            ids, scores = ids[top], scores[top]
+        order = np.argsort(-scores, kind='stable')
+        return ids[order], scores[order]
+
+    def write(self, path: str):
+        terms = sorted(self.postings)
+        sizes = [len(self.postings[term][0]) for term in terms]
+        offsets = np.zeros(len(terms) + 1, dtype='int64')
+        np.cumsum(sizes, out=offsets[1:])
+
+        ids = np.concatenate([self.postings[term][0] for term in terms]) if terms else np.empty(0, dtype='int64')
+        tfs = np.concatenate([self.postings[term][1] for term in terms]) if terms else np.empty(0, dtype='uint16')
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                terms=np.frombuffer(json.dumps(terms, ensure_ascii=False).encode('utf-8'), dtype='uint8'),
+                offsets=offsets,
+                ids=ids,
+                tfs=tfs,
+                lengths=self.lengths,
+                totals=np.array([self.count, self.total_length], dtype='int64'),
+                version=np.array([self.version], dtype='int32')
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'LexicalIndex':
+        with np.load(path) as data:
+            terms = json.loads(data['terms'].tobytes().decode('utf-8'))
+            offsets, ids, tfs = data['offsets'], data['ids'], data['tfs']
+            count, total_length = (int(v) for v in data['totals'])
+            version = int(data['version'][0]) if 'version' in data.files else 1
+            postings = {
+                term: (ids[offsets[i]:offsets[i + 1]], tfs[offsets[i]:offsets[i + 1]])
+                for i, term in enumerate(terms)
+            }
+            return cls(postings, data['lengths'], count, total_length, version)
+
+    def get_stats(self) -> Dict:
+        postings = sum(len(ids) for ids, _ in self.postings.values())
+        return {
+            'terms': len(self.postings),
+            'postings': postings,
+            'postings_mb': round(postings * 10 / 1024 / 1024, 2),
+            'stemmer': 'snowball' if _snowball else 'builtin'
+        }
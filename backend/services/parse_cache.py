@@ -0,0 +1,106 @@
+import json
+import os
+import threading
+import zlib
+from typing import Dict, List, Optional, Union
+import config
+
+
+# Extracted page texts (and parser evaluations) keyed by PDF content hash, stored as zlib-compressed JSON in
+# one <hash>.<kind>-<parser version>.z file each. A parser upgrade changes the version, so old entries simply
+# stop matching and are removed by prune().
+class ParseCache:
+    SUFFIX = '.z'
+
+    def __init__(self, root: str, versions: Dict[str, str]):
+        self.root = root
+        self.versions = versions
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _name(self, content_hash: str, kind: str) -> str:
+        return f"{content_hash}.{kind}-{self.versions[kind]}{self.SUFFIX}"
+
+    def get(self, content_hash: str, kind: str) -> Optional[Union[List[str], Dict]]:
+        try:
+            with open(os.path.join(self.root, self._name(content_hash, kind)), 'rb') as f:
+                value = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+        except FileNotFoundError:
+            value = None
+        except (OSError, ValueError, zlib.error) as e:
+            print(f"Unreadable parse cache entry for {content_hash[:12]}: {e}")
+            value = None
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put(self, content_hash: str, kind: str, value: Union[List[str], Dict]):
+        path = os.path.join(self.root, self._name(content_hash, kind))
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(zlib.compress(json.dumps(value, ensure_ascii=False).encode('utf-8'), 6))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not write parse cache entry for {content_hash[:12]}: {e}")
+
+    def invalidate(self, content_hash: Optional[str] = None) -> int:
+        # Drops the entries of one file, or the whole cache
+        removed = 0
+        for file_name in os.listdir(self.root):
+            if content_hash is None or file_name.startswith(content_hash + '.'):
+                try:
+                    os.remove(os.path.join(self.root, file_name))
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def prune(self) -> int:
+        # Removes entries written by other parser versions and leftovers of interrupted writes
+        current = {f"{kind}-{version}{self.SUFFIX}" for kind, version in self.versions.items()}
+        removed = 0
+        for file_name in os.listdir(self.root):
+            if file_name.split('.', 1)[-1] not in current:
+                try:
+                    os.remove(os.path.join(self.root, file_name))
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def get_stats(self) -> Dict:
+        sizes = [entry.stat().st_size for entry in os.scandir(self.root) if entry.name.endswith(self.SUFFIX)]
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(sizes),
+            'size_mb': round(sum(sizes) / 1024 / 1024, 2),
+            'versions': self.versions,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_parse_cache() -> Optional[ParseCache]:
+    global _cache
+    if not config.PARSE_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            from .file_parser import parser_versions
+            _cache = ParseCache(config.PARSE_CACHE_DIR, parser_versions())
+            removed = _cache.prune()
+            if removed:
+                print(f"Removed {removed} parse cache entries of other parser versions")
+    return _cache
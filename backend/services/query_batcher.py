@@ -0,0 +1,64 @@
+import queue
+import threading
+import time
+import numpy as np
+from concurrent.futures import Future
+from typing import Callable, Dict, List
+
+
+class QueryBatcher:
+    def __init__(self, encode: Callable[[List[str]], np.ndarray], window_ms: float, max_batch: int):
+        self.encode_batch = encode
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self.batches = 0
+        self.queries = 0
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name='query-batcher', daemon=True)
+        self._worker.start()
+
+    def encode(self, text: str) -> np.ndarray:
+        future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = list(dict.fromkeys(text for text, _ in batch))
+
+            try:
+                vectors = np.asarray(self.encode_batch(texts), dtype='float32')
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            rows = {text: i for i, text in enumerate(texts)}
+            for text, future in batch:
+                future.set_result(vectors[rows[text]:rows[text] + 1].copy())
+
+            self.batches += 1
+            self.queries += len(batch)
+
+    def get_stats(self) -> Dict:
+        return {
+            'batches': self.batches,
+            'queries': self.queries,
+            'avg_batch_size': round(self.queries / self.batches, 2) if self.batches else 0
+        }
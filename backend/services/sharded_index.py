@@ -0,0 +1,186 @@
+import os
+import uuid
+import numpy as np
+import faiss
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from .index_factory import (TRAINED_TYPES, can_train, create_index, configure_search, index_type_of, bytes_per_vector,
+                            search as search_index)
+import config
+
+_executor = None
+
+# Training sample for the shared template; k-means gains nothing from more
+MAX_TRAINING_VECTORS = 100000
+
+# The template is retrained once the corpus has grown this many times past what it was trained on
+RETRAIN_GROWTH = 4
+
+
+def _search_pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max(1, config.SEARCH_THREADS), thread_name_prefix='shard-search')
+    return _executor
+
+
+# One FAISS index per document. Shards are never modified in place: adding to a document replaces
+# its shard and every other shard object is shared with the previous ShardedIndex.
+# Trained index types clone their shards from an empty template trained on the whole corpus, so all
+# shards share its centroids and codebooks; until there are enough vectors for one, those shards are flat.
+class ShardedIndex:
+    def __init__(self, dimension: int, shards: Optional[Dict[str, object]] = None,
+                 files: Optional[Dict[str, str]] = None, template=None, template_file: Optional[str] = None,
+                 trained_on: int = 0):
+        self.d = dimension
+        self.shards = shards or {}
+        self.files = files or {}
+        self.template = template
+        self.template_file = template_file
+        self.trained_on = trained_on
+
+    @property
+    def ntotal(self) -> int:
+        return sum(shard.ntotal for shard in self.shards.values())
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.shards
+
+    def needs_template(self) -> bool:
+        # True when the configured index type has no template yet, or one trained on a much smaller corpus,
+        # and enough vectors are stored to train a new one
+        if config.INDEX_TYPE not in TRAINED_TYPES or not can_train(config.INDEX_TYPE, self.ntotal):
+            return False
+        return (self.template is None or index_type_of(self.template) != config.INDEX_TYPE
+                or self.ntotal >= RETRAIN_GROWTH * self.trained_on)
+
+    def build_shard(self, vectors: np.ndarray, ids: np.ndarray):
+        if self.template is not None and index_type_of(self.template) == config.INDEX_TYPE:
+            shard = configure_search(faiss.clone_index(self.template))
+        else:
+            shard = create_index(self.d, vectors, 'flat' if config.INDEX_TYPE in TRAINED_TYPES else None)
+        shard.add_with_ids(vectors, ids)
+        return shard
+
+    def _derive(self, shards: Dict[str, object], files: Dict[str, str]) -> 'ShardedIndex':
+        return ShardedIndex(self.d, shards, files, self.template, self.template_file, self.trained_on)
+
+    def with_vectors(self, name: str, vectors: np.ndarray, ids: np.ndarray) -> 'ShardedIndex':
+        if name in self.shards:
+            shard = faiss.clone_index(self.shards[name])
+            configure_search(shard)
+            shard.add_with_ids(vectors, ids)
+        else:
+            shard = self.build_shard(vectors, ids)
+
+        shards = dict(self.shards)
+        shards[name] = shard
+        files = dict(self.files)
+        files.pop(name, None)
+        return self._derive(shards, files)
+
+    def without(self, name: str) -> 'ShardedIndex':
+        shards = dict(self.shards)
+        files = dict(self.files)
+        shards.pop(name, None)
+        files.pop(name, None)
+        return self._derive(shards, files)
+
+    def search(self, query: np.ndarray, top_k: int, rerank: int = 0,
+               vectors_for: Optional[Callable[[np.ndarray], Optional[np.ndarray]]] = None,
+               names: Optional[Iterable[str]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        shards = [self.shards[name] for name in (self.shards if names is None else names) if name in self.shards]
+        shards = [shard for shard in shards if shard.ntotal]
+
+        def search_shard(shard):
+            return search_index(shard, query, min(top_k, shard.ntotal), rerank, vectors_for)
+
+        # FAISS releases the GIL while it scans, so shards are searched side by side
+        if len(shards) > 1:
+            results = list(_search_pool().map(search_shard, shards))
+        else:
+            results = [search_shard(shard) for shard in shards]
+
+        if not results:
+            return np.empty((1, 0), dtype='float32'), np.empty((1, 0), dtype='int64')
+
+        distances = np.concatenate([d[0] for d, _ in results])
+        ids = np.concatenate([i[0] for _, i in results])
+        found = ids >= 0
+        distances, ids = distances[found], ids[found]
+        order = np.argsort(distances, kind='stable')[:top_k]
+        return distances[order][None, :], ids[order][None, :]
+
+    def index_type(self) -> str:
+        types = Counter(index_type_of(shard) for shard in self.shards.values())
+        return types.most_common(1)[0][0] if types else config.INDEX_TYPE
+
+    def bytes_per_vector(self) -> int:
+        total = self.ntotal
+        if not total:
+            return 0
+        return round(sum(bytes_per_vector(shard) * shard.ntotal for shard in self.shards.values()) / total)
+
+    def get_stats(self) -> Dict:
+        sizes = [shard.ntotal for shard in self.shards.values()]
+        return {
+            'shards': len(sizes),
+            'largest_shard': max(sizes, default=0),
+            'types': dict(Counter(index_type_of(shard) for shard in self.shards.values())),
+            'template': index_type_of(self.template) if self.template is not None else None
+        }
+
+    @staticmethod
+    def _write_file(directory: str, prefix: str, index) -> str:
+        file_name = f"{prefix}_{uuid.uuid4().hex}.faiss"
+        tmp_path = os.path.join(directory, file_name + '.tmp')
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, os.path.join(directory, file_name))
+        return file_name
+
+    def write(self, directory: str) -> 'ShardedIndex':
+        os.makedirs(directory, exist_ok=True)
+
+        # Only shards created since the last write get a new file; the rest are already on disk
+        files = {}
+        for name, shard in self.shards.items():
+            file_name = self.files.get(name)
+            if not file_name or not os.path.exists(os.path.join(directory, file_name)):
+                file_name = self._write_file(directory, 'shard', shard)
+            files[name] = file_name
+
+        template_file = self.template_file
+        if self.template is not None and not (template_file and os.path.exists(os.path.join(directory, template_file))):
+            template_file = self._write_file(directory, 'template', self.template)
+
+        return ShardedIndex(self.d, self.shards, files, self.template, template_file, self.trained_on)
+
+    @classmethod
+    def open(cls, directory: str, dimension: int, files: Dict[str, str],
+             template_file: Optional[str] = None, trained_on: int = 0) -> 'ShardedIndex':
+        shards = {
+            name: configure_search(faiss.read_index(os.path.join(directory, file_name)))
+            for name, file_name in files.items()
+        }
+        template = faiss.read_index(os.path.join(directory, template_file)) if template_file else None
+        return cls(dimension, shards, dict(files), template, template_file, trained_on)
+
+    @staticmethod
+    def train_template(dimension: int, ids: np.ndarray, vectors_for: Callable[[np.ndarray], np.ndarray]):
+        if config.INDEX_TYPE not in TRAINED_TYPES or not can_train(config.INDEX_TYPE, len(ids)):
+            return None
+        if len(ids) > MAX_TRAINING_VECTORS:
+            ids = np.sort(np.random.default_rng(0).choice(ids, MAX_TRAINING_VECTORS, replace=False))
+        return create_index(dimension, vectors_for(ids))
+
+    @classmethod
+    def from_chunks(cls, dimension: int, document_chunks: Dict[str, List[int]],
+                    vectors_for: Callable[[np.ndarray], np.ndarray]) -> 'ShardedIndex':
+        all_ids = np.array([chunk_id for ids in document_chunks.values() for chunk_id in ids], dtype='int64')
+        template = cls.train_template(dimension, all_ids, vectors_for)
+        index = cls(dimension, template=template, trained_on=len(all_ids) if template is not None else 0)
+        for name, ids in document_chunks.items():
+            ids = np.array(ids, dtype='int64')
+            index.shards[name] = index.build_shard(vectors_for(ids), ids)
+        return index
@@ -0,0 +1,184 @@
+import json
+import os
+import shutil
+import time
+from typing import Dict, List, Optional, Tuple
+from .chunk_store import ChunkAliases, ChunkStore
+from .lexical_index import LexicalIndex, TOKENIZER_VERSION
+from .sharded_index import ShardedIndex
+
+
+def _fsync_file(path: str):
+    with open(path, 'rb+') as f:
+        os.fsync(f.fileno())
+
+
+def _fsync_dir(path: str):
+    # Windows cannot open directories; NTFS renames are journaled anyway
+    if os.name == 'nt':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# Each save goes to snapshots/.tmp-<name>, is fsynced, renamed to snapshots/<name> and only then
+# published by atomically replacing the CURRENT pointer. Shard files live in a shared pool so a
+# snapshot only writes the shards that changed since the previous one.
+class SnapshotStore:
+    CURRENT_FILE = 'CURRENT'
+    MANIFEST_FILE = 'manifest.json'
+    KEEP = 2
+
+    def __init__(self, root: str):
+        self.root = root
+        self.snapshots_dir = os.path.join(root, 'snapshots')
+        self.shards_dir = os.path.join(root, 'index_shards')
+        self.generation = 0
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.snapshots_dir, name)
+
+    def _current_name(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.root, self.CURRENT_FILE), 'r', encoding='utf-8') as f:
+                return json.load(f)['snapshot']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _snapshot_names(self) -> List[str]:
+        return sorted(
+            (name for name in os.listdir(self.snapshots_dir)
+             if not name.startswith('.') and os.path.exists(os.path.join(self._path(name), self.MANIFEST_FILE))),
+            reverse=True
+        )
+
+    def exists(self) -> bool:
+        return bool(self._snapshot_names())
+
+    def _open(self, name: str) -> Tuple[ShardedIndex, ChunkStore, Optional[LexicalIndex], ChunkAliases, Dict]:
+        directory = self._path(name)
+        with open(os.path.join(directory, self.MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+        store = ChunkStore.open(directory)
+        index = ShardedIndex.open(self.shards_dir, manifest['dimension'], manifest['shards'],
+                                   manifest.get('template'), manifest.get('template_vectors', 0))
+
+        if index.ntotal != len(store) or len(store) != manifest['chunks']:
+            raise ValueError(f"{index.ntotal} vectors, {len(store)} chunks, manifest says {manifest['chunks']}")
+
+        lexical = None
+        lexical_path = os.path.join(directory, LexicalIndex.FILE)
+        if os.path.exists(lexical_path):
+            lexical = LexicalIndex.load(lexical_path)
+            if lexical.count != len(store):
+                print(f"Lexical index in snapshot {name} has {lexical.count} chunks, store has {len(store)}")
+                lexical = None
+            elif lexical.version != TOKENIZER_VERSION:
+                print(f"Lexical index in snapshot {name} uses tokenizer {lexical.version}, rebuilding")
+                lexical = None
+
+        aliases_path = os.path.join(directory, ChunkAliases.FILE)
+        aliases = ChunkAliases.load(aliases_path) if os.path.exists(aliases_path) else ChunkAliases()
+
+        return index, store, lexical, aliases, manifest
+
+    def load(self) -> Optional[Tuple[ShardedIndex, ChunkStore, Optional[LexicalIndex], ChunkAliases, Dict]]:
+        current = self._current_name()
+        names = self._snapshot_names()
+        if current in names:
+            names.remove(current)
+            names.insert(0, current)
+
+        # Fall back to older snapshots rather than starting empty when the newest one is damaged
+        for name in names:
+            try:
+                index, store, lexical, aliases, manifest = self._open(name)
+                self.generation = manifest['generation']
+                if name != current:
+                    print(f"Snapshot {current} is unusable, using {name}")
+                return index, store, lexical, aliases, manifest
+            except Exception as e:
+                print(f"Skipping snapshot {name}: {e}")
+        return None
+
+    def write(self, index: ShardedIndex, store: ChunkStore, lexical: LexicalIndex, aliases: ChunkAliases,
+              next_id: int) -> Tuple[ShardedIndex, ChunkStore, Dict]:
+        # Never reuse the name of a newer snapshot that failed to load
+        existing = [int(name.rsplit('_', 1)[1]) for name in self._snapshot_names() if name.startswith('snapshot_')]
+        generation = max([self.generation] + existing) + 1
+        name = f"snapshot_{generation:08d}"
+        tmp_dir = self._path(f".tmp-{name}")
+        final_dir = self._path(name)
+        for path in (tmp_dir, final_dir):
+            shutil.rmtree(path, ignore_errors=True)
+
+        index = index.write(self.shards_dir)
+        for file_name in list(index.files.values()) + ([index.template_file] if index.template_file else []):
+            _fsync_file(os.path.join(self.shards_dir, file_name))
+        _fsync_dir(self.shards_dir)
+
+        store.write(tmp_dir)
+        lexical.write(os.path.join(tmp_dir, LexicalIndex.FILE))
+        aliases.write(os.path.join(tmp_dir, ChunkAliases.FILE))
+
+        manifest = {
+            'generation': generation,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'dimension': index.d,
+            'next_id': next_id,
+            'chunks': len(store),
+            'aliases': len(aliases),
+            'vectors': index.ntotal,
+            'shards': index.files,
+            'template': index.template_file,
+            'template_vectors': index.trained_on
+        }
+        with open(os.path.join(tmp_dir, self.MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+
+        for file_name in os.listdir(tmp_dir):
+            _fsync_file(os.path.join(tmp_dir, file_name))
+        _fsync_dir(tmp_dir)
+
+        os.rename(tmp_dir, final_dir)
+        _fsync_dir(self.snapshots_dir)
+
+        current_tmp = os.path.join(self.root, self.CURRENT_FILE + '.tmp')
+        with open(current_tmp, 'w', encoding='utf-8') as f:
+            json.dump({'snapshot': name}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(current_tmp, os.path.join(self.root, self.CURRENT_FILE))
+        _fsync_dir(self.root)
+
+        self.generation = generation
+        self._collect_garbage()
+        return index, ChunkStore.open(final_dir), manifest
+
+    def _collect_garbage(self):
+        keep = self._snapshot_names()[:self.KEEP]
+        live_shards = set()
+        for name in keep:
+            try:
+                with open(os.path.join(self._path(name), self.MANIFEST_FILE), 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                live_shards.update(manifest['shards'].values())
+                live_shards.add(manifest.get('template'))
+            except (OSError, ValueError, KeyError):
+                pass
+
+        # Mapped files of dropped snapshots may still be open on Windows; they are retried next save
+        for name in os.listdir(self.snapshots_dir):
+            if name not in keep:
+                shutil.rmtree(self._path(name), ignore_errors=True)
+        for file_name in os.listdir(self.shards_dir):
+            if file_name not in live_shards:
+                try:
+                    os.remove(os.path.join(self.shards_dir, file_name))
+                except OSError:
+                    pass
@@ -0,0 +1,71 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import config
+from backend.services.encoders import ENCODER_BACKENDS, load_model
+from benchmarks.index_types import QUESTIONS, load_corpus
+
+
+def cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check parity and speed of the embedding backends')
+    parser.add_argument('--backends', nargs='+', default=list(ENCODER_BACKENDS), choices=ENCODER_BACKENDS)
+    parser.add_argument('--chunks', type=int, default=512, help='corpus chunks used for parity and batch throughput')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--min-cosine', type=float, default=0.98,
+                        help='fail if any vector drifts below this cosine similarity to the torch reference')
+    args = parser.parse_args()
+
+    chunks = load_corpus(config.DOCS_DIR)[:args.chunks] or QUESTIONS * 8
+    texts = QUESTIONS + chunks
+
+    reference_model, _ = load_model(config.EMBEDDINGS_MODEL, 'torch')
+    reference = reference_model.encode(texts, convert_to_numpy=True, batch_size=args.batch_size)
+
+    print(f"{len(QUESTIONS)} queries, {len(chunks)} chunks\n")
+    print(f"{'backend':<12}{'mean cos':>10}{'min cos':>10}{'query p50 ms':>14}{'query p99 ms':>14}{'batch chunks/s':>16}")
+
+    failed = False
+    for backend in args.backends:
+        model, loaded = load_model(config.EMBEDDINGS_MODEL, backend)
+        if loaded != backend:
+            print(f"{backend:<12}unavailable")
+            continue
+
+        vectors = model.encode(texts, convert_to_numpy=True, batch_size=args.batch_size)
+        similarity = cosine(reference, vectors)
+
+        latencies = []
+        for question in QUESTIONS * 5:
+            start = time.perf_counter()
+            model.encode([question], convert_to_numpy=True)
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        model.encode(chunks, convert_to_numpy=True, batch_size=args.batch_size)
+        throughput = len(chunks) / (time.perf_counter() - start)
+
+        print(f"{backend:<12}{similarity.mean():>10.4f}{similarity.min():>10.4f}"
+              f"{np.percentile(latencies, 50) * 1000:>14.2f}{np.percentile(latencies, 99) * 1000:>14.2f}"
+              f"{throughput:>16.1f}")
+
+        if similarity.min() < args.min_cosine:
+            print(f"  {backend} drifts below cosine {args.min_cosine} from the torch reference")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import glob
+import os
+import sys
+import time
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import faiss
+import config
+from backend.services.file_parser import FileParser
+from backend.services.index_factory import (
+    INDEX_TYPES, LOSSY_TYPES, create_index, index_type_of, bytes_per_vector, search as search_index
+)
+
+QUESTIONS = [
+    "Какие средства защиты нужны при работе на высоте?",
+    "Кто допускается к работе в электроустановках?",
+    "Требования к погрузочно-разгрузочным работам вручную",
+    "Какая группа по электробезопасности нужна для оперативных переключений?",
+    "Правила безопасности при работе с ручным электроинструментом",
+    "Обязанности работодателя при строительстве",
+    "Требования к ограждениям строительных лесов",
+    "Охрана труда водителей автомобильного транспорта",
+    "Требования промышленной безопасности в нефтяной и газовой промышленности",
+    "Оборудование, работающее под избыточным давлением",
+]
+
+
+def load_corpus(docs_dir: str):
+    chunks = []
+    for file_path in sorted(glob.glob(os.path.join(docs_dir, '*.pdf'))):
+        result = FileParser.parse_pdf(file_path)
+        if not result['success']:
+            print(f"Skipping {os.path.basename(file_path)}: {result['error']}")
+            continue
+        chunks.extend(FileParser.chunk_text(result['content'], config.CHUNK_SIZE, config.CHUNK_OVERLAP))
+    return chunks
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000)
+
+
+def benchmark(index_type: str, vectors: np.ndarray, queries: np.ndarray, truth: np.ndarray, top_k: int,
+              rerank: int = 0):
+    start = time.perf_counter()
+    index = create_index(vectors.shape[1], vectors, index_type)
+    index.add_with_ids(vectors, np.arange(len(vectors), dtype='int64'))
+    build_seconds = time.perf_counter() - start
+
+    latencies = []
+    recalls = []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        _, found = search_index(index, query.reshape(1, -1), top_k, rerank, lambda ids: vectors[ids])
+        latencies.append(time.perf_counter() - start)
+        recalls.append(len(set(found[0].tolist()) & set(expected.tolist())) / top_k)
+
+    return {
+        'index_type': index_type_of(index) + (f"+rr{rerank}" if rerank else ''),
+        'build_s': build_seconds,
+        'size_mb': len(faiss.serialize_index(index)) / 1024 / 1024,
+        'mb_per_million': bytes_per_vector(index) * 1e6 / 1024 / 1024,
+        'recall': float(np.mean(recalls)),
+        'p50_ms': percentile_ms(latencies, 50),
+        'p99_ms': percentile_ms(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare FAISS index types on the docs/ corpus')
+    parser.add_argument('--docs', default=config.DOCS_DIR)
+    parser.add_argument('--top-k', type=int, default=config.TOP_K_RESULTS)
+    parser.add_argument('--sample-queries', type=int, default=200,
+                        help='extra queries taken from chunk prefixes on top of the fixed questions')
+    parser.add_argument('--types', nargs='+', default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    parser.add_argument('--rerank', type=int, nargs='+', default=[0, 4],
+                        help='shortlist multipliers to try for compressed index types')
+    args = parser.parse_args()
+
+    from backend.services.encoders import load_model
+
+    chunks = load_corpus(args.docs)
+    if not chunks:
+        print("No chunks to benchmark")
+        return
+
+    model, _ = load_model(config.EMBEDDINGS_MODEL)
+
+    start = time.perf_counter()
+    vectors = model.encode(chunks, convert_to_numpy=True, batch_size=64).astype('float32')
+    print(f"Encoded {len(chunks)} chunks in {time.perf_counter() - start:.1f}s")
+
+    rng = np.random.default_rng(0)
+    sampled = rng.choice(len(chunks), size=min(args.sample_queries, len(chunks)), replace=False)
+    query_texts = QUESTIONS + [chunks[i][:200] for i in sampled]
+    queries = model.encode(query_texts, convert_to_numpy=True).astype('float32')
+
+    baseline = faiss.IndexFlatL2(vectors.shape[1])
+    baseline.add(vectors)
+    _, truth = baseline.search(queries, args.top_k)
+
+    print(f"{len(query_texts)} queries, recall@{args.top_k} against exact flat search\n")
+    print(f"{'type':<14}{'build s':>10}{'size MB':>10}{'MB/1M':>10}{'recall':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for index_type in args.types:
+        for rerank in (args.rerank if index_type in LOSSY_TYPES else [0]):
+            row = benchmark(index_type, vectors, queries, truth, args.top_k, rerank)
+            print(f"{row['index_type']:<14}{row['build_s']:>10.2f}{row['size_mb']:>10.2f}{row['mb_per_million']:>10.0f}"
+                  f"{row['recall']:>10.3f}{row['p50_ms']:>10.3f}{row['p99_ms']:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
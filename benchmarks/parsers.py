@@ -0,0 +1,89 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import config
+from backend.services.file_parser import FileParser, PARSE_METHODS
+
+RESULTS_DIR = os.path.join(PROJECT_ROOT, 'benchmarks', 'results')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the PDF text extraction backends on every document')
+    parser.add_argument('--docs', default=config.DOCS_DIR)
+    parser.add_argument('--sample-pages', type=int, default=config.PARSE_SAMPLE_PAGES)
+    parser.add_argument('--full', action='store_true',
+                        help='also extract every page with every backend to check the sampled choice')
+    parser.add_argument('--output', help='JSON report path (default: benchmarks/results/parsers_<time>.json)')
+    args = parser.parse_args()
+
+    print(f"{'document':<48}{'pages':>6}"
+          + ''.join(f"{method + ' ms/p':>16}{'chars/p':>9}{'garbled':>9}" for method in PARSE_METHODS)
+          + f"{'chosen':>12}" + (f"{'full':>12}" if args.full else ''))
+
+    documents = []
+    agree = 0
+    for file_path in sorted(glob.glob(os.path.join(args.docs, '*.pdf'))):
+        name = os.path.basename(file_path)
+        try:
+            sampled = FileParser.evaluate_parsers(file_path, args.sample_pages, compare_all=True)
+            full = FileParser.evaluate_parsers(file_path, sampled['pages_count'], compare_all=True) if args.full \
+                else None
+        except Exception as e:
+            print(f"{name[:47]:<48}failed: {e}")
+            documents.append({'document': name, 'error': str(e)})
+            continue
+
+        row = f"{name[:47]:<48}{sampled['pages_count']:>6}"
+        for method in PARSE_METHODS:
+            result = sampled['backends'][method]
+            if 'error' in result:
+                row += f"{'error':>16}{'':>9}{'':>9}"
+            else:
+                row += f"{result.get('ms_per_page', 0):>16.2f}{result.get('chars_per_page', 0):>9.0f}" \
+                       f"{result.get('garbled', 0):>9.3f}"
+        row += f"{sampled['method']:>12}"
+        if full:
+            row += f"{full['method']:>12}"
+            agree += full['method'] == sampled['method']
+        print(row)
+
+        documents.append({'document': name, 'sampled': sampled, 'full': full})
+
+    evaluated = [doc for doc in documents if 'error' not in doc]
+    summary = {
+        'documents': len(documents),
+        'failed': len(documents) - len(evaluated),
+        'chosen': {method: sum(doc['sampled']['method'] == method for doc in evaluated) for method in PARSE_METHODS},
+        'no_text': sum(doc['sampled']['no_text'] for doc in evaluated)
+    }
+    if args.full:
+        summary['sample_agrees_with_full'] = agree
+    print(f"\n{json.dumps(summary, ensure_ascii=False)}")
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {
+            'sample_pages': args.sample_pages,
+            'min_yield_ratio': config.PARSE_MIN_YIELD_RATIO,
+            'full': args.full
+        },
+        'summary': summary,
+        'documents': documents
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"parsers_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Report written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import config
+from backend.services.query_batcher import QueryBatcher
+from benchmarks.index_types import QUESTIONS
+
+
+def run(encode, queries, clients: int) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(encode, queries))
+    return len(queries) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-query and micro-batched query encoding')
+    parser.add_argument('--queries', type=int, default=512)
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--window-ms', type=float, default=config.QUERY_BATCH_WINDOW_MS or 5)
+    parser.add_argument('--max-batch', type=int, default=config.QUERY_BATCH_MAX)
+    args = parser.parse_args()
+
+    from backend.services.encoders import load_model
+
+    model, _ = load_model(config.EMBEDDINGS_MODEL)
+    batcher = QueryBatcher(lambda texts: model.encode(texts, convert_to_numpy=True), args.window_ms, args.max_batch)
+
+    # Distinct texts so nothing is deduplicated inside a batch
+    queries = [f"{QUESTIONS[i % len(QUESTIONS)]} ({i})" for i in range(args.queries)]
+    model.encode(queries[:8], convert_to_numpy=True)
+
+    print(f"{args.queries} queries, window {args.window_ms} ms, max batch {args.max_batch}\n")
+    print(f"{'clients':<10}{'single q/s':>14}{'batched q/s':>14}{'speedup':>10}")
+    for clients in args.clients:
+        single = run(lambda q: model.encode([q], convert_to_numpy=True), queries, clients)
+        batched = run(batcher.encode, queries, clients)
+        print(f"{clients:<10}{single:>14.1f}{batched:>14.1f}{batched / single:>9.2f}x")
+
+    print(f"\nBatcher: {batcher.get_stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import config
+
+FIXTURES = os.path.join(PROJECT_ROOT, 'benchmarks', 'fixtures', 'retrieval_questions.json')
+RESULTS_DIR = os.path.join(PROJECT_ROOT, 'benchmarks', 'results')
+HIT_KS = (1, 3, 5, 10)
+
+
+def rss_mb() -> float:
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        return 0.0
+
+
+def dir_size_mb(path: str) -> float:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total / 1024 / 1024
+
+
+def normalize_name(filename: str) -> str:
+    return filename.replace(' ', '').upper()
+
+
+def is_hit(filename: str, expected) -> bool:
+    name = normalize_name(filename)
+    return any(normalize_name(e) in name for e in expected)
+
+
+def percentiles_ms(samples):
+    return {f"p{q}_ms": round(float(np.percentile(samples, q) * 1000), 3) for q in (50, 95, 99)}
+
+
+def build(docs_dir: str):
+    from backend.models import db, Document
+    from backend.services.file_parser import FileParser
+    from backend.services.embeddings import EmbeddingsService
+
+    db.connect(reuse_if_open=True)
+    db.create_tables([Document], safe=True)
+
+    start = time.perf_counter()
+    pages = 0
+    for file_path in sorted(glob.glob(os.path.join(docs_dir, '*.pdf'))):
+        result = FileParser.parse_pdf(file_path)
+        if not result['success']:
+            print(f"Skipping {os.path.basename(file_path)}: {result['error']}")
+            continue
+        pages += result['pages_count']
+        Document.create(filename=os.path.basename(file_path), content=result['content'],
+                        file_path=file_path, pages_count=result['pages_count'])
+    parse_seconds = time.perf_counter() - start
+
+    service = EmbeddingsService()
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    service.rebuild_index()
+    index_seconds = time.perf_counter() - start
+    service.save_index(wait=True)
+
+    return service, {
+        'documents': Document.select().count(),
+        'pages': pages,
+        'chunks': len(service.snapshot.store),
+        'shared_chunks': len(service.snapshot.aliases),
+        'parse_s': round(parse_seconds, 3),
+        'index_s': round(index_seconds, 3),
+        'rss_mb': round(rss_mb(), 1),
+        'index_rss_delta_mb': round(rss_mb() - rss_before, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'index_file_mb': round(dir_size_mb(service.snapshots.shards_dir), 2),
+        'disk_mb': round(dir_size_mb(config.EMBEDDINGS_DIR), 2)
+    }
+
+
+def evaluate(service, questions, mode: str, top_k: int, repeat: int):
+    config.SEARCH_MODE = mode
+    search_latencies = []
+    context_latencies = []
+    hits = {k: 0 for k in HIT_KS if k <= top_k}
+    reciprocal_ranks = []
+    context_lengths = []
+    context_tokens = []
+    misses = []
+
+    for item in questions:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results = service.search(item['question'], top_k, mode)
+            search_latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            context, packing = service.pack_context(item['question'], top_k)
+            context_latencies.append(time.perf_counter() - start)
+
+        filenames = [r['metadata']['filename'] for r in results]
+        rank = next((i + 1 for i, name in enumerate(filenames) if is_hit(name, item['expected'])), None)
+        for k in hits:
+            hits[k] += bool(rank and rank <= k)
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+        context_lengths.append(len(context))
+        context_tokens.append(packing['tokens'])
+        if not rank:
+            misses.append(item['question'])
+
+    return {
+        'search': percentiles_ms(search_latencies),
+        'get_context': percentiles_ms(context_latencies),
+        **{f"hit@{k}": round(count / len(questions), 3) for k, count in hits.items()},
+        'mrr': round(float(np.mean(reciprocal_ranks)), 3),
+        'avg_context_chars': round(float(np.mean(context_lengths)), 1),
+        'avg_context_tokens': round(float(np.mean(context_tokens)), 1),
+        'misses': misses
+    }
+
+
+def flatten(report, prefix=''):
+    values = {}
+    for key, value in report.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[prefix + key] = value
+    return values
+
+
+def compare(report, baseline_path: str):
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = flatten(json.load(f))
+    current = flatten(report)
+
+    print(f"\nCompared with {baseline_path}:")
+    for key in sorted(current):
+        if key in baseline and baseline[key] != current[key]:
+            change = f" ({(current[key] - baseline[key]) / baseline[key] * 100:+.1f}%)" if baseline[key] else ''
+            print(f"  {key}: {baseline[key]} -> {current[key]}{change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark chunking, indexing and retrieval on the docs/ corpus')
+    parser.add_argument('--docs', default=config.DOCS_DIR)
+    parser.add_argument('--questions', default=FIXTURES)
+    parser.add_argument('--top-k', type=int, default=config.TOP_K_RESULTS)
+    parser.add_argument('--chunk-size', type=int, default=config.CHUNK_SIZE)
+    parser.add_argument('--chunk-overlap', type=int, default=config.CHUNK_OVERLAP)
+    parser.add_argument('--index-type', default=config.INDEX_TYPE)
+    parser.add_argument('--modes', nargs='+', default=['vector', 'lexical', 'hybrid'])
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per question')
+    parser.add_argument('--query-cache', action='store_true', help='keep the query embedding LRU enabled')
+    parser.add_argument('--online', action='store_true', help='allow downloading the model')
+    parser.add_argument('--parse-cache', action='store_true',
+                        help='read parsed text from the real parse cache (parse_s then measures cache hits)')
+    parser.add_argument('--output', help='JSON report path (default: benchmarks/results/retrieval_<time>.json)')
+    parser.add_argument('--compare', help='earlier JSON report to diff against')
+    args = parser.parse_args()
+
+    if not args.online:
+        os.environ.setdefault('HF_HUB_OFFLINE', '1')
+        os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+
+    with open(args.questions, 'r', encoding='utf-8') as f:
+        questions = json.load(f)
+
+    # Everything is built in a scratch directory so the real index and database are untouched
+    workdir = tempfile.mkdtemp(prefix='retrieval_bench_')
+    config.EMBEDDINGS_DIR = workdir
+    config.DATABASE_PATH = os.path.join(workdir, 'bench.db')
+    config.PARSE_CACHE_ENABLED = args.parse_cache
+    config.CHUNK_SIZE = args.chunk_size
+    config.CHUNK_OVERLAP = args.chunk_overlap
+    config.INDEX_TYPE = args.index_type
+    config.QUERY_BATCH_WINDOW_MS = 0
+    if not args.query_cache:
+        config.QUERY_CACHE_SIZE = 0
+
+    try:
+        service, corpus = build(args.docs)
+        if not corpus['chunks']:
+            print("No chunks to benchmark")
+            return
+
+        service.search(questions[0]['question'], args.top_k)
+
+        report = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'platform': platform.platform(),
+            'config': {
+                'model': config.EMBEDDINGS_MODEL,
+                'encoder_backend': service.backend,
+                'index_type': service.get_stats()['index_type'],
+                'chunk_size': args.chunk_size,
+                'chunk_overlap': args.chunk_overlap,
+                'top_k': args.top_k,
+                'questions': len(questions),
+                'repeat': args.repeat,
+                'query_cache': args.query_cache,
+                'parse_cache': args.parse_cache
+            },
+            'build': corpus,
+            'modes': {mode: evaluate(service, questions, mode, args.top_k, args.repeat) for mode in args.modes}
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{corpus['documents']} documents, {corpus['pages']} pages, {corpus['chunks']} chunks; "
+          f"parse {corpus['parse_s']}s, index {corpus['index_s']}s, peak RSS {corpus['peak_rss_mb']} MB")
+    hit_columns = [key for key in report['modes'][args.modes[0]] if key.startswith('hit@')]
+    print(f"{'mode':<10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}" + ''.join(f"{key:>8}" for key in hit_columns)
+          + f"{'mrr':>8}")
+    for mode, row in report['modes'].items():
+        print(f"{mode:<10}{row['search']['p50_ms']:>10.2f}{row['search']['p95_ms']:>10.2f}"
+              f"{row['search']['p99_ms']:>10.2f}" + ''.join(f"{row[key]:>8.2f}" for key in hit_columns)
+              + f"{row['mrr']:>8.2f}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"retrieval_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nReport written to {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
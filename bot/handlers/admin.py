@@ -1,3 +1,5 @@
+import asyncio
+import os
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
@@ -6,7 +8,8 @@ from aiogram.fsm.state import State, StatesGroup
 from bot.keyboards import get_admin_menu, get_document_actions, get_confirm_delete
 from bot.utils.uploader import (
     download_file, 
-    upload_document_to_backend,
+    ingest_backend_document,
+    get_backend_job,
     get_backend_stats,
     get_backend_documents,
     delete_backend_document,
@@ -45,6 +48,33 @@ async def btn_upload(message: Message, state: FSMContext):
     
     await cmd_upload(message, state)
 
+JOB_STAGES = {
+    'process': 'Извлечение текста и построение эмбеддингов',
+    'publish': 'Добавление в индекс'
+}
+
+
+async def wait_for_job(job: dict, processing_msg: Message, timeout: float = 900) -> dict:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    shown = None
+
+    while job.get('status') in ('queued', 'running') and loop.time() < deadline:
+        await asyncio.sleep(2)
+        result = await get_backend_job(job['id'])
+        if not result.get('success'):
+            continue
+        job = result['job']
+
+        stage = JOB_STAGES.get(job.get('stage'), 'В очереди')
+        text = f"{stage}... {job.get('progress', 0) * 100:.0f}%"
+        if text != shown and job.get('status') in ('queued', 'running'):
+            await processing_msg.edit_text(text)
+            shown = text
+
+    return job
+
+
 @router.message(UploadStates.waiting_for_file, F.document)
 async def process_document(message: Message, state: FSMContext):
     document = message.document
@@ -63,26 +93,36 @@ async def process_document(message: Message, state: FSMContext):
     processing_msg = await message.answer("Загружаю и обрабатываю документ...")
 
     try:
-        file_path = await download_file(message.bot, document.file_id, filename)
+        # Downloaded under a .part name so neither an existing document nor the docs/ scan sees it;
+        # the backend renames it once the name and content are checked
+        file_path = await download_file(message.bot, document.file_id, f"{filename}.part")
 
         if not file_path:
             await processing_msg.edit_text("Ошибка загрузки файла")
             return
 
-        result = await upload_document_to_backend(file_path)
+        result = await ingest_backend_document(filename, file_path)
 
-        if result.get('success'):
-            success_text = f"Документ успешно загружен!\n\nФайл: {filename}\n"
+        if not result.get('success'):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            error_msg = result.get('error', 'Unknown error')
+            await processing_msg.edit_text(f"Ошибка: {error_msg}")
+            return
 
-            doc_info = result.get('document', {})
-            if doc_info:
-                success_text += f"Страниц: {doc_info.get('pages_count', 'N/A')}\n"
-                success_text += f"Символов: {doc_info.get('content_length', 0):,}\n"
+        job = await wait_for_job(result['job'], processing_msg)
 
+        if job.get('status') == 'done':
+            success_text = f"Документ успешно загружен!\n\nФайл: {filename}\n"
+            success_text += f"Страниц: {job.get('pages_count', 'N/A')}\n"
+            success_text += f"Фрагментов: {job.get('chunks_count', 0):,}\n"
             await processing_msg.edit_text(success_text)
+        elif job.get('status') in ('failed', 'skipped'):
+            await processing_msg.edit_text(f"Ошибка: {job.get('error') or 'Unknown error'}")
         else:
-            error_msg = result.get('error', 'Unknown error')
-            await processing_msg.edit_text(f"Ошибка: {error_msg}")
+            await processing_msg.edit_text(
+                f"Документ {filename} ещё обрабатывается (задача #{job['id']}), он появится в базе автоматически."
+            )
 
     except Exception as e:
         await processing_msg.edit_text(f"Ошибка: {str(e)}")
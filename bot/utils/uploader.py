@@ -21,18 +21,30 @@ async def download_file(bot: Bot, file_id: str, filename: str) -> Optional[str]:
         print(f"Error downloading file: {e}")
         return None
 
-async def upload_document_to_backend(file_path: str) -> Dict:
+async def ingest_backend_document(filename: str, file_path: str) -> Dict:
+    # The backend reads DOCS_DIR too, so only the name of the downloaded file is sent, not its bytes
     try:
         async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=ssl_context)) as session:
-            with open(file_path, 'rb') as f:
-                data = aiohttp.FormData()
-                data.add_field('file', f, filename=os.path.basename(file_path))
-                
-                url = f"https://{config.FLASK_HOST}:{config.FLASK_PORT}/admin/upload"
-                
-                async with session.post(url, data=data) as response:
-                    result = await response.json()
-                    return result
+            url = f"https://{config.FLASK_HOST}:{config.FLASK_PORT}/admin/ingest"
+            payload = {'filename': filename, 'staged': os.path.basename(file_path)}
+
+            async with session.post(url, json=payload) as response:
+                result = await response.json()
+                return result
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+async def get_backend_job(job_id: int) -> Dict:
+    try:
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=ssl_context)) as session:
+            url = f"https://{config.FLASK_HOST}:{config.FLASK_PORT}/admin/jobs/{job_id}"
+            
+            async with session.get(url) as response:
+                result = await response.json()
+                return result
     except Exception as e:
         return {
             'success': False,
@@ -29,9 +29,70 @@ DOCS_DIR = os.path.join(BASE_DIR, 'docs')
 EMBEDDINGS_DIR = os.path.join(BASE_DIR, 'embeddings')
 
 # RAG Settings
+EMBEDDINGS_MODEL = os.getenv('EMBEDDINGS_MODEL', 'all-MiniLM-L6-v2')
+# torch, onnx or onnx_int8 (dynamically quantized ONNX export, cached under EMBEDDINGS_DIR/onnx)
+EMBEDDINGS_BACKEND = os.getenv('EMBEDDINGS_BACKEND', 'torch')
+EMBEDDINGS_ONNX_QUANTIZATION = os.getenv('EMBEDDINGS_ONNX_QUANTIZATION', 'avx2')
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
 TOP_K_RESULTS = 5
+ENCODE_BATCH_SIZE = int(os.getenv('ENCODE_BATCH_SIZE', 256))
+# Spawned encoder processes for rebuilds; each one loads its own copy of the model, so the default stays small
+# and fewer than ENCODE_PARALLEL_MIN_CHUNKS chunks (e.g. most misses of the embedding cache) encode in-process
+ENCODE_WORKERS = int(os.getenv('ENCODE_WORKERS', min(2, os.cpu_count() or 1)))
+ENCODE_PARALLEL_MIN_CHUNKS = int(os.getenv('ENCODE_PARALLEL_MIN_CHUNKS', 2048))
+ENCODE_THREADS_PER_WORKER = int(os.getenv('ENCODE_THREADS_PER_WORKER', max(1, (os.cpu_count() or 1) // ENCODE_WORKERS)))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', 200000))
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', 1024))
+QUERY_BATCH_WINDOW_MS = float(os.getenv('QUERY_BATCH_WINDOW_MS', 5))
+QUERY_BATCH_MAX = int(os.getenv('QUERY_BATCH_MAX', 32))
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', 512))
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.95))
+# Share of stemmed terms a cached question must have in common with the new one (numbers, negations and
+# comparisons such as выше/ниже must match exactly)
+ANSWER_CACHE_MIN_OVERLAP = float(os.getenv('ANSWER_CACHE_MIN_OVERLAP', 0.7))
+
+# Vector index: flat, ivf_flat, hnsw, ivf_pq, or compressed sq8 / pq
+INDEX_TYPE = os.getenv('INDEX_TYPE', 'flat')
+# Re-rank top_k * INDEX_RERANK compressed hits with the exact float vectors (0 disables)
+INDEX_RERANK = int(os.getenv('INDEX_RERANK', 0))
+INDEX_NLIST = int(os.getenv('INDEX_NLIST', 0))
+INDEX_NPROBE = int(os.getenv('INDEX_NPROBE', 8))
+INDEX_HNSW_M = int(os.getenv('INDEX_HNSW_M', 32))
+INDEX_HNSW_EF_CONSTRUCTION = int(os.getenv('INDEX_HNSW_EF_CONSTRUCTION', 80))
+INDEX_HNSW_EF_SEARCH = int(os.getenv('INDEX_HNSW_EF_SEARCH', 64))
+INDEX_PQ_M = int(os.getenv('INDEX_PQ_M', 48))
+
+# Retrieval: vector, lexical (BM25) or hybrid (weighted sum of min-max normalised scores)
+SEARCH_MODE = os.getenv('SEARCH_MODE', 'hybrid')
+HYBRID_LEXICAL_WEIGHT = float(os.getenv('HYBRID_LEXICAL_WEIGHT', 0.5))
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', 4))
+# PDF text extraction: processes splitting the pages of one document, used from this many pages up and never
+# on a single CPU. PyMuPDF reads ~200 pages/sec serially; on 1 CPU the pool took 3.2s vs 0.2s serial for 43 pages
+# (first call, worker start-up) and 2.2s vs 1.7s for 330 pages with the workers already running.
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', min(4, os.cpu_count() or 1)))
+PARSE_PARALLEL_MIN_PAGES = int(os.getenv('PARSE_PARALLEL_MIN_PAGES', 256))
+# Text extraction backend: pymupdf, pdfplumber or auto (per document, the fastest backend on a sample of pages
+# whose readable text per page is within PARSE_MIN_YIELD_RATIO of the best backend). auto samples PyMuPDF first
+# and only times pdfplumber (~35x slower per page) when more than PARSE_MAX_EMPTY_SHARE of the sampled pages are
+# empty or more than PARSE_MAX_GARBLED of the text is garbage
+PARSE_METHOD = os.getenv('PARSE_METHOD', 'auto')
+PARSE_SAMPLE_PAGES = int(os.getenv('PARSE_SAMPLE_PAGES', 6))
+PARSE_MIN_YIELD_RATIO = float(os.getenv('PARSE_MIN_YIELD_RATIO', 0.9))
+PARSE_MAX_EMPTY_SHARE = float(os.getenv('PARSE_MAX_EMPTY_SHARE', 0.5))
+PARSE_MAX_GARBLED = float(os.getenv('PARSE_MAX_GARBLED', 0.01))
+# Extracted page texts kept by file hash and parser version, so re-ingesting an unchanged PDF skips extraction
+PARSE_CACHE_ENABLED = os.getenv('PARSE_CACHE_ENABLED', 'True').lower() == 'true'
+PARSE_CACHE_DIR = os.getenv('PARSE_CACHE_DIR', os.path.join(EMBEDDINGS_DIR, 'parse_cache'))
+# Background ingestion (parse, chunk, embed, publish) of uploaded and newly found PDFs
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 2))
+INGEST_POLL_SECONDS = float(os.getenv('INGEST_POLL_SECONDS', 2))
+# Context sent to GigaChat: token budget (estimated from characters) and minimum cosine similarity of a chunk
+CONTEXT_MAX_TOKENS = int(os.getenv('CONTEXT_MAX_TOKENS', 1200))
+CONTEXT_MIN_SIMILARITY = float(os.getenv('CONTEXT_MIN_SIMILARITY', 0.2))
+CONTEXT_CHARS_PER_TOKEN = float(os.getenv('CONTEXT_CHARS_PER_TOKEN', 3.5))
+# Threads used to search the per-document index shards side by side
+SEARCH_THREADS = int(os.getenv('SEARCH_THREADS', min(8, os.cpu_count() or 1)))
 
 # Create directories if not exist
 os.makedirs(DOCS_DIR, exist_ok=True)
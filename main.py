@@ -3,6 +3,9 @@ import os
 import subprocess
 import signal
 import time
+import json
+import ssl
+import urllib.request
 
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, PROJECT_ROOT)
@@ -48,6 +51,33 @@ def generate_ssl_cert():
         print(f"Ошибка генерации SSL: {e}")
         return False
 
+def wait_for_backend(proc, timeout: float = 600) -> bool:
+    import config
+
+    host = '127.0.0.1' if config.FLASK_HOST in ('0.0.0.0', '') else config.FLASK_HOST
+    url = f"https://{host}:{config.FLASK_PORT}/api/health"
+    context = ssl._create_unverified_context()
+    deadline = time.monotonic() + timeout
+    status = None
+
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            print(f"Flask exited with code {proc.returncode}")
+            return False
+        try:
+            with urllib.request.urlopen(url, context=context, timeout=2) as response:
+                status = json.load(response).get('ready')
+            if status in ('ready', 'error'):
+                print(f"Backend {status}")
+                return status == 'ready'
+        except OSError:
+            pass
+        time.sleep(0.5)
+
+    print(f"Backend not ready after {timeout:.0f}s (last status: {status}), starting bot anyway")
+    return False
+
+
 def signal_handler(sig, frame):
     print('\nОстановка сервисов...')
     for proc in processes:
@@ -74,7 +104,7 @@ if __name__ == '__main__':
     processes.append(flask_proc)
     print(f'Flask started (PID: {flask_proc.pid})')
 
-    time.sleep(2)
+    wait_for_backend(flask_proc)
 
     bot_proc = subprocess.Popen(
         [sys.executable, os.path.join(PROJECT_ROOT, 'bot', 'bot.py')],